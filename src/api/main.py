@@ -1,35 +1,273 @@
-import sqlite3
-from fastapi import FastAPI, HTTPException, Query
+import hmac
+import os
+import threading
+import time
+from typing import Literal
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
+from pydantic import BaseModel, Field
 from src.config import DB_PATH
+from src.search.fts_index import (
+    FTS_TABLE,
+    fts_exists,
+    fts_match,
+    fts_order,
+    isbn_index_exists,
+)
+from src.search.sqlite_pool import SqlitePool
 from fastapi.middleware.cors import CORSMiddleware
 
 DB_FILE = DB_PATH
 app = FastAPI(title="Book Finder API")
 from src.search.semantic_search import (
+    attach_search_engine,
+    index_version,
     load_books_from_db,
     load_or_build_embeddings,
+    load_query_model,
     SemanticSearchEngine,
 )
 
-rows = load_books_from_db()
-embeddings, emb_row_ids = load_or_build_embeddings(rows)
-search_engine = SemanticSearchEngine(rows, embeddings, emb_row_ids)
+# "attach" (default): mmap prepared artifacts shared by all workers, building
+# them once under a file lock if needed; "build": every worker loads the
+# catalog and validates the artifacts itself
+SEARCH_INDEX_MODE = os.environ.get("SEARCH_INDEX_MODE", "attach")
+
+# coalesce concurrent /search/* queries into one encode call (0 disables)
+MICRO_BATCH_WINDOW_MS = float(os.environ.get("MICRO_BATCH_WINDOW_MS", "3"))
+MICRO_BATCH_MAX_SIZE = int(os.environ.get("MICRO_BATCH_MAX_SIZE", "32"))
+
+# partition semantic/hybrid search across this many shard processes (0 disables)
+SEARCH_SHARDS = int(os.environ.get("SEARCH_SHARDS", "0"))
+
+# hot reload: POST /admin/reload (disabled unless ADMIN_TOKEN is set; the
+# X-Admin-Token header must match it) or a poll of the index version every
+# INDEX_WATCH_SECONDS (0 disables).
+# The replaced engine is closed RELOAD_GRACE_SECONDS after the swap.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+INDEX_WATCH_SECONDS = float(os.environ.get("INDEX_WATCH_SECONDS", "0"))
+RELOAD_GRACE_SECONDS = float(os.environ.get("RELOAD_GRACE_SECONDS", "30"))
+
+
+def build_search_engine(model=None):
+    if SEARCH_INDEX_MODE == "attach":
+        engine = attach_search_engine(model=model)
+    else:
+        # the catalog rows are only needed while artifacts are validated;
+        # keeping them out of module scope lets them be freed afterwards
+        rows = load_books_from_db()
+        embeddings, emb_row_ids = load_or_build_embeddings(rows)
+        engine = SemanticSearchEngine(rows, embeddings, emb_row_ids, model=model)
+
+    if MICRO_BATCH_WINDOW_MS > 0:
+        engine.enable_micro_batching(MICRO_BATCH_WINDOW_MS, MICRO_BATCH_MAX_SIZE)
+    if SEARCH_SHARDS > 0:
+        engine.enable_sharding(SEARCH_SHARDS)
+    return engine
+
+
+# -------------------------------
+# STARTUP
+# -------------------------------
+# the engine is loaded in the background after startup, so /health answers
+# immediately; search routes return 503 until /ready reports "ready"
+search_engine = None
+startup_status = {
+    "state": "starting",
+    "started_at": time.time(),
+    "ready_at": None,
+    "error": None,
+}
+
+
+def load_search_engine():
+    global search_engine
+    try:
+        startup_status["state"] = "loading model"
+        model = load_query_model()
+
+        startup_status["state"] = "loading index"
+        engine = build_search_engine(model=model)
+
+        startup_status["state"] = "warming up"
+        engine.warm_up()
+
+        search_engine = engine
+        reload_status["index_version"] = engine.version
+        startup_status.update(state="ready", ready_at=time.time())
+        elapsed = startup_status["ready_at"] - startup_status["started_at"]
+        print(f"[INFO] Search engine ready in {elapsed:.1f}s")
+    except Exception as exc:
+        startup_status.update(state="failed", error=str(exc))
+        print(f"[WARN] Search engine failed to load: {exc}")
+
+
+def get_engine():
+    engine = search_engine
+    if engine is None:
+        raise HTTPException(
+            status_code=503, detail=f"search engine {startup_status['state']}"
+        )
+    return engine
+
+
+# -------------------------------
+# HOT RELOAD
+# -------------------------------
+reload_lock = threading.Lock()
+reload_status = {
+    "state": "idle",
+    "index_version": None,
+    "started_at": None,
+    "finished_at": None,
+    "error": None,
+}
+
+
+def retire_search_engine(engine):
+    engine.close()
+    print(f"[INFO] Closed search engine for index version {engine.version}")
+
+
+def reload_search_engine():
+    # Builds and warms a new engine next to the serving one, then swaps the
+    # module reference in one assignment: requests already running finish on
+    # the old engine, new ones go to the new engine. Returns False if a
+    # reload is already in progress.
+    global search_engine
+    if not reload_lock.acquire(blocking=False):
+        return False
+
+    try:
+        reload_status.update(state="loading", started_at=time.time(), error=None)
+        old = get_engine()
+
+        engine = build_search_engine(model=old.model)
+        engine.warm_up()
+        # query embeddings do not depend on the index, so keep them
+        engine.query_cache = old.query_cache
+
+        search_engine = engine
+        # daemon: a pending retire must not keep the process alive on shutdown
+        timer = threading.Timer(RELOAD_GRACE_SECONDS, retire_search_engine, (old,))
+        timer.daemon = True
+        timer.start()
+
+        reload_status.update(
+            state="idle", index_version=engine.version, finished_at=time.time()
+        )
+        print(f"[INFO] Search engine reloaded (index version {engine.version})")
+    except Exception as exc:
+        reload_status.update(state="failed", error=str(exc), finished_at=time.time())
+        print(f"[WARN] Search engine reload failed, keeping the old one: {exc}")
+    finally:
+        reload_lock.release()
+
+    return True
+
+
+def watch_index():
+    while True:
+        time.sleep(INDEX_WATCH_SECONDS)
+        if search_engine is None:
+            continue
+        try:
+            changed = index_version() != search_engine.version
+        except OSError:
+            continue
+        if changed and not reload_lock.locked():
+            print("[INFO] Index files changed. Reloading search engine...")
+            reload_search_engine()
 
 
 @app.on_event("startup")
 def validate_db():
-    conn = sqlite3.connect(str(DB_PATH))
+    # read-only check: schema migrations run in storage/db_create.py or
+    # python -m src.search.prepare_index, never in API workers
+    conn = get_conn()
     cur = conn.cursor()
     cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='books'")
     if not cur.fetchone():
         raise RuntimeError("Missing books table")
-    conn.close()
+
+    if not fts_exists(conn):
+        raise RuntimeError(
+            f"Missing {FTS_TABLE} full-text index. Run python storage/db_create.py "
+            "or python -m src.search.prepare_index to add it."
+        )
+    if not isbn_index_exists(conn):
+        print("[WARN] books(isbn) is not indexed; /search/isbn will scan the table.")
+
+
+@app.on_event("startup")
+def start_search_engine():
+    threading.Thread(
+        target=load_search_engine, name="engine-loader", daemon=True
+    ).start()
+
+
+@app.on_event("startup")
+def start_index_watcher():
+    if INDEX_WATCH_SECONDS > 0:
+        threading.Thread(target=watch_index, name="index-watcher", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def shutdown_search_engine():
+    db_pool.close()
+    engine = search_engine
+    if engine is None:
+        return
+    if engine.result_cache is not None:
+        engine.result_cache.save()
+    engine.close()
+
+
+# read-only, per-thread connections shared by the SQL routes; handlers must
+# not close them
+db_pool = SqlitePool(DB_FILE)
 
 
 def get_conn():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connection()
+
+
+BOOK_FIELDS = (
+    "row_id",
+    "isbn",
+    "title",
+    "author",
+    "year",
+    "publisher",
+    "description",
+    "subjects",
+    "description_source",
+    "subjects_source",
+)
+
+
+def fts_search(q, limit, column=None, fields=BOOK_FIELDS):
+    # ranked (bm25) full-text lookup; the last word of q matches as a prefix
+    match = fts_match(q, column)
+    if match is None:
+        raise HTTPException(status_code=404, detail="book not found")
+
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT {", ".join(f"b.{f}" for f in fields)}
+        FROM {FTS_TABLE}
+        JOIN books b ON b.row_id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH ?
+        ORDER BY {fts_order()}
+        LIMIT ?
+        """,
+        (match, limit),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        raise HTTPException(status_code=404, detail="book not found")
+    return [dict(r) for r in rows]
 
 
 @app.get("/")
@@ -42,20 +280,128 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+def ready():
+    status = dict(startup_status)
+    status["elapsed"] = (status["ready_at"] or time.time()) - status["started_at"]
+    if search_engine is None:
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
+
+@app.get("/stats")
+def stats():
+    engine = get_engine()
+    batcher = engine.batcher
+    cache = engine.query_cache
+    results = engine.result_cache
+    shards = engine.shards
+    return {
+        "index": dict(reload_status),
+        "sqlite_pool": db_pool.stats(),
+        "micro_batching": batcher.stats() if batcher else None,
+        "sharding": shards.stats() if shards else None,
+        "similar_books": engine.similar_stats(),
+        "query_embedding_cache": cache.stats() if cache else None,
+        "result_cache": results.stats() if results else None,
+    }
+
+
+@app.post("/admin/reload", status_code=202)
+def reload_index(x_admin_token: str | None = Header(None)):
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=404, detail="admin endpoints are disabled")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="invalid admin token")
+    get_engine()
+
+    started = not reload_lock.locked()
+    if started:
+        threading.Thread(
+            target=reload_search_engine, name="index-reload", daemon=True
+        ).start()
+    return {"started": started, "index": dict(reload_status)}
+
+
+class SearchFilters(BaseModel):
+    year_min: int | None = None
+    year_max: int | None = None
+    subject: str | None = None
+    description_source: str | None = None
+    subjects_source: str | None = None
+
+
+def filter_dict(filters):
+    if filters is None:
+        return None
+    if (
+        filters.year_min is not None
+        and filters.year_max is not None
+        and filters.year_min > filters.year_max
+    ):
+        raise HTTPException(status_code=400, detail="year_min must be <= year_max")
+    return filters.model_dump()
+
+
 @app.get("/search/semantic")
 def semantic_search(
     q: str = Query(..., min_length=1),
     top_k: int = Query(5, ge=1, le=20),
+    exact: bool = False,
+    nprobe: int | None = Query(None, ge=1),
+    filters: SearchFilters = Depends(),
 ):
-    return search_engine.embedding_only_search(q, top_k=top_k)
+    return get_engine().embedding_only_search(
+        q, top_k=top_k, exact=exact, nprobe=nprobe, filters=filter_dict(filters)
+    )
 
 
 @app.get("/search/hybrid")
 def hybrid_search(
     q: str = Query(..., min_length=1),
     top_k: int = Query(5, ge=1, le=20),
+    filters: SearchFilters = Depends(),
+):
+    return get_engine().hybrid_search(q, top_k=top_k, filters=filter_dict(filters))
+
+
+@app.get("/search/fused")
+def fused_search(
+    q: str = Query(..., min_length=1),
+    top_k: int = Query(5, ge=1, le=20),
+    method: Literal["weighted", "rrf"] | None = None,
+    alpha: float | None = Query(None, ge=0.0, le=1.0),
+    filters: SearchFilters = Depends(),
 ):
-    return search_engine.hybrid_search(q, top_k=top_k)
+    return get_engine().fused_search(
+        q, top_k=top_k, method=method, alpha=alpha, filters=filter_dict(filters)
+    )
+
+
+class BatchSearchRequest(BaseModel):
+    queries: list[str] = Field(..., min_length=1, max_length=1000)
+    mode: Literal["semantic", "hybrid", "fused"] = "semantic"
+    top_k: int = Field(5, ge=1, le=20)
+    filters: SearchFilters | None = None
+
+
+@app.post("/search/batch")
+def batch_search(req: BatchSearchRequest):
+    if any(not q.strip() for q in req.queries):
+        raise HTTPException(status_code=400, detail="queries must be non-empty")
+
+    filters = filter_dict(req.filters)
+    if req.mode == "fused":
+        return get_engine().fused_search_batch(
+            req.queries, top_k=req.top_k, filters=filters
+        )
+    if req.mode == "hybrid":
+        return get_engine().hybrid_search_batch(
+            req.queries, top_k=req.top_k, filters=filters
+        )
+    return get_engine().embedding_only_search_batch(
+        req.queries, top_k=req.top_k, filters=filters
+    )
 
 
 @app.get("/books")
@@ -72,7 +418,6 @@ def books(limit: int = 1000):
         (limit,),
     )
     row = [dict(r) for r in cur.fetchall()]
-    conn.close()
     return row
 
 
@@ -92,7 +437,6 @@ def search_by_row_id(row_id: int):
     )
 
     row = cur.fetchone()
-    conn.close()
 
     if not row:
         raise HTTPException(status_code=404, detail="book not found")
@@ -100,46 +444,22 @@ def search_by_row_id(row_id: int):
     return dict(row)
 
 
+@app.get("/books/{row_id}/similar")
+def similar_books(row_id: int, top_k: int = Query(5, ge=1, le=50)):
+    results = get_engine().similar_books(row_id, top_k=top_k)
+    if results is None:
+        raise HTTPException(status_code=404, detail="book not found")
+    return results
+
+
 @app.get("/search/title")
 def search_by_title(q: str, limit: int = 50):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-                SELECT row_id, isbn, title, author, year, publisher,
-                    description, subjects, description_source, subjects_source
-                FROM books
-                WHERE title LIKE ?
-                LIMIT ?
-                """,
-        (f"%{q}%", limit),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    if not rows:
-        raise HTTPException(status_code=404, detail="book not found")
-    return [dict(r) for r in rows]
+    return fts_search(q, limit, column="title")
 
 
 @app.get("/search/author")
 def search_by_author(q: str, limit: int = 50):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-                SELECT row_id, isbn, title, author, year, publisher,
-                    description, subjects, description_source, subjects_source
-                FROM books
-                WHERE author LIKE ?
-                LIMIT ?
-                """,
-        (f"%{q}%", limit),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    if not rows:
-        raise HTTPException(status_code=404, detail="book not found")
-    return [dict(r) for r in rows]
+    return fts_search(q, limit, column="author")
 
 
 @app.get("/search/isbn")
@@ -157,7 +477,6 @@ def search_by_isbn(q: str):
         (q.strip(),),
     )
     row = cur.fetchone()
-    conn.close()
     if not row:
         raise HTTPException(status_code=404, detail="book not found")
     return dict(row)
@@ -165,71 +484,17 @@ def search_by_isbn(q: str):
 
 @app.get("/search/subjects")
 def search_by_subjects(q: str, limit: int = 50):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-                SELECT row_id, isbn, title, author, year, publisher,
-                    description, subjects, description_source, subjects_source
-                FROM books
-                WHERE subjects LIKE ?
-                LIMIT ?
-                """,
-        (f"%{q}%", limit),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    if not rows:
-        raise HTTPException(status_code=404, detail="book not found")
-    return [dict(r) for r in rows]
+    return fts_search(q, limit, column="subjects")
 
 
 @app.get("/search/description")
 def search_by_description(q: str, limit: int = 50):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-                SELECT row_id, isbn, title, author, year, publisher,
-                    description, subjects, description_source, subjects_source
-                FROM books
-                WHERE description LIKE ?
-                LIMIT ?
-                """,
-        (f"%{q}%", limit),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    if not rows:
-        raise HTTPException(status_code=404, detail="book not found")
-    return [dict(r) for r in rows]
+    return fts_search(q, limit, column="description")
 
 
 @app.get("/search/all")
 def search_everywhere(q: str, limit: int = 50):
-    conn = get_conn()
-    cur = conn.cursor()
-
-    like = f"%{q}%"
-    cur.execute(
-        """
-        SELECT row_id, isbn, title, author, year, publisher,
-               description, subjects
-        FROM books
-        WHERE title LIKE ?
-           OR author LIKE ?
-           OR subjects LIKE ?
-           OR description LIKE ?
-        LIMIT ?
-    """,
-        (like, like, like, like, limit),
-    )
-
-    rows = cur.fetchall()
-    conn.close()
-    if not rows:
-        raise HTTPException(status_code=404, detail="book not found")
-    return [dict(r) for r in rows]
+    return fts_search(q, limit, fields=BOOK_FIELDS[:8])
 
 
 app.add_middleware(
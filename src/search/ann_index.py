@@ -0,0 +1,654 @@
+import json
+import time
+import numpy as np
+from pathlib import Path
+
+from src.search.embedding_store import as_embedding_store, atomic_save
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+IVF_KMEANS_ITERS = 10
+IVF_SAMPLE_PER_LIST = 64
+IVF_ASSIGN_BLOCK_ROWS = 65536
+IVF_DEFAULT_NPROBE = 8
+
+# queries scored per matrix-matrix product in batched exact search
+QUERY_BLOCK = 256
+
+# filters matching at most this fraction of rows are scored on a gathered copy
+FILTER_GATHER_FRACTION = 0.25
+
+# binary first pass: shortlist = top_k * BINARY_RESCORE_FACTOR rows by Hamming
+# distance (at least BINARY_MIN_SHORTLIST), rescored at full precision
+BINARY_RESCORE_FACTOR = 10
+BINARY_MIN_SHORTLIST = 100
+BINARY_BLOCK_ROWS = 65536
+
+# reduced-dimension index: "pca" projection or "truncate" (prefix of a
+# Matryoshka-trained embedding); top_k * REDUCED_RESCORE_FACTOR candidates are
+# rescored at full dimension (0 ranks in the reduced space only)
+REDUCED_DEFAULT_DIM = 128
+REDUCED_METHODS = ("pca", "truncate")
+REDUCED_RESCORE_FACTOR = 10
+PCA_SAMPLE_ROWS = 50000
+
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.unpackbits(
+        np.arange(256, dtype=np.uint8)[:, None], axis=1
+    ).sum(axis=1, dtype=np.uint8)
+
+    def popcount(x):
+        table = _POPCOUNT_TABLE[x.view(np.uint8)].reshape(*x.shape, -1)
+        return table.sum(axis=-1, dtype=np.uint8)
+
+
+# -------------------------------
+# TOP-K
+# -------------------------------
+def top_k_desc(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part])]
+
+
+def eligible_rows(mask):
+    # None means every row is eligible
+    return None if mask is None else np.flatnonzero(mask)
+
+
+# -------------------------------
+# EXACT
+# -------------------------------
+class ExactIndex:
+    kind = "exact"
+
+    def __init__(self, embeddings):
+        self.embeddings = as_embedding_store(embeddings)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def search(self, q_emb, top_k, mask=None, **_):
+        return self.search_batch(np.asarray(q_emb)[None, :], top_k, mask=mask)[0]
+
+    def search_batch(self, q_embs, top_k, mask=None, **_):
+        # a selective filter gathers and scores only the eligible rows; a broad
+        # one scores everything and selects among the eligible rows, so a
+        # filtered scan is never more work than the unfiltered one
+        rows = eligible_rows(mask)
+        gather = rows is not None and len(rows) <= FILTER_GATHER_FRACTION * len(self)
+        store = as_embedding_store(self.embeddings[rows]) if gather else self.embeddings
+
+        results = []
+        for start in range(0, len(q_embs), QUERY_BLOCK):
+            block_scores = store.scores(q_embs[start : start + QUERY_BLOCK])
+            for scores in block_scores:
+                if rows is not None and not gather:
+                    scores = scores[rows]
+                idx = top_k_desc(scores, top_k)
+                results.append((idx if rows is None else rows[idx], scores[idx]))
+        return results
+
+
+# -------------------------------
+# IVF-FLAT
+# -------------------------------
+def ivf_paths(embeddings_file):
+    stem = Path(embeddings_file).with_suffix("")
+    return {
+        "meta": stem.with_name(f"{stem.name}.ivf.json"),
+        "centroids": stem.with_name(f"{stem.name}.ivf.centroids.npy"),
+        "offsets": stem.with_name(f"{stem.name}.ivf.offsets.npy"),
+        "ids": stem.with_name(f"{stem.name}.ivf.ids.npy"),
+    }
+
+
+def default_nlist(n):
+    return int(max(1, min(n // 39, 4 * np.sqrt(n))))
+
+
+def _assign(embeddings, centroids):
+    n = len(embeddings)
+    labels = np.empty(n, dtype=np.int32)
+
+    for start in range(0, n, IVF_ASSIGN_BLOCK_ROWS):
+        end = min(start + IVF_ASSIGN_BLOCK_ROWS, n)
+        block = embeddings[start:end]
+        labels[start:end] = np.argmax(block @ centroids.T, axis=1)
+
+    return labels
+
+
+def train_centroids(embeddings, nlist, seed=0):
+    rng = np.random.default_rng(seed)
+    n = len(embeddings)
+
+    sample_size = min(n, nlist * IVF_SAMPLE_PER_LIST)
+    sample = embeddings[np.sort(rng.choice(n, size=sample_size, replace=False))]
+    centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+
+    # spherical k-means: embeddings are L2-normalized, so assign by dot product
+    for _ in range(IVF_KMEANS_ITERS):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+class IVFFlatIndex:
+    kind = "ivf"
+
+    def __init__(self, embeddings, centroids, offsets, ids, nprobe=IVF_DEFAULT_NPROBE):
+        self.embeddings = as_embedding_store(embeddings)
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.nprobe = nprobe
+
+        if len(ids) != len(self.embeddings):
+            raise RuntimeError("IVF index and embeddings length mismatch")
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, embeddings, nlist=None, nprobe=IVF_DEFAULT_NPROBE, seed=0):
+        store = as_embedding_store(embeddings)
+        nlist = nlist or default_nlist(len(store))
+
+        centroids = train_centroids(store, nlist, seed=seed)
+        labels = _assign(store, centroids)
+
+        ids = np.argsort(labels, kind="stable").astype(np.int64)
+        counts = np.bincount(labels, minlength=nlist)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        return cls(store, centroids, offsets, ids, nprobe=nprobe)
+
+    def candidates(self, q_emb, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        lists = top_k_desc(self.centroids @ q_emb, nprobe)
+
+        return np.concatenate(
+            [self.ids[self.offsets[c] : self.offsets[c + 1]] for c in lists]
+        )
+
+    def search(self, q_emb, top_k, nprobe=None, mask=None, **_):
+        q_emb = np.asarray(q_emb, dtype=np.float32)
+        cand = self.candidates(q_emb, nprobe)
+        if mask is not None:
+            cand = cand[mask[cand]]
+
+        # probed lists too small to fill top_k: fall back to the exact scan
+        if len(cand) < top_k:
+            return ExactIndex(self.embeddings).search(q_emb, top_k, mask=mask)
+
+        cand.sort()
+        scores = self.embeddings.gather_scores(cand, q_emb)
+        best = top_k_desc(scores, top_k)
+        return cand[best], scores[best]
+
+    def search_batch(self, q_embs, top_k, nprobe=None, mask=None, **_):
+        return [self.search(q, top_k, nprobe=nprobe, mask=mask) for q in q_embs]
+
+    def save(self, embeddings_file, source=None):
+        paths = ivf_paths(embeddings_file)
+
+        atomic_save(paths["centroids"], self.centroids)
+        atomic_save(paths["offsets"], self.offsets)
+        atomic_save(paths["ids"], self.ids)
+        meta = {
+            "n_rows": len(self.ids),
+            "nlist": self.nlist,
+            "dim": self.embeddings.dim,
+            "source": source,
+        }
+        paths["meta"].write_text(json.dumps(meta))
+
+    @classmethod
+    def load(cls, embeddings, embeddings_file, nprobe=IVF_DEFAULT_NPROBE, source=None):
+        paths = ivf_paths(embeddings_file)
+        if not all(p.exists() for p in paths.values()):
+            return None
+
+        meta = json.loads(paths["meta"].read_text())
+        if meta["n_rows"] != len(embeddings) or meta.get("source") != source:
+            print("[WARN] IVF index is stale (embeddings changed). Ignoring it.")
+            return None
+
+        return cls(
+            embeddings,
+            np.load(paths["centroids"]),
+            np.load(paths["offsets"]),
+            np.load(paths["ids"], mmap_mode="r"),
+            nprobe=nprobe,
+        )
+
+
+# -------------------------------
+# BINARY (SIGN-BIT) FIRST PASS
+# -------------------------------
+def binary_paths(embeddings_file):
+    stem = Path(embeddings_file).with_suffix("")
+    return {
+        "meta": stem.with_name(f"{stem.name}.binary.json"),
+        "codes": stem.with_name(f"{stem.name}.binary.codes.npy"),
+    }
+
+
+def binarize(embeddings):
+    # one sign bit per dimension, packed into 64-bit words (zero padded)
+    bits = np.packbits(np.asarray(embeddings) > 0, axis=-1)
+    pad = -bits.shape[-1] % 8
+    if pad:
+        bits = np.concatenate([bits, np.zeros((*bits.shape[:-1], pad), np.uint8)], -1)
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+class BinaryIndex:
+    kind = "binary"
+
+    # Codes are 32x smaller than float32, so they stay in L2/L3 and the
+    # exhaustive Hamming scan runs from cache; only the shortlist touches the
+    # full-precision store.
+    # planes[w] holds word w of every row's code, so the scan streams
+    # contiguous uint64 columns.
+    def __init__(self, embeddings, planes, rescore=BINARY_RESCORE_FACTOR):
+        self.embeddings = as_embedding_store(embeddings)
+        self.planes = planes
+        self.rescore = rescore
+
+        if planes.shape[1] != len(self.embeddings):
+            raise RuntimeError("Binary codes and embeddings length mismatch")
+
+    def __len__(self):
+        return self.planes.shape[1]
+
+    @classmethod
+    def build(cls, embeddings, rescore=BINARY_RESCORE_FACTOR):
+        store = as_embedding_store(embeddings)
+        n_words = (store.dim + 63) // 64
+        planes = np.empty((n_words, len(store)), dtype=np.uint64)
+
+        for start in range(0, len(store), BINARY_BLOCK_ROWS):
+            end = min(start + BINARY_BLOCK_ROWS, len(store))
+            planes[:, start:end] = binarize(store[start:end]).T
+
+        return cls(store, planes, rescore=rescore)
+
+    def distances(self, q_code, rows=None):
+        planes = self.planes if rows is None else self.planes[:, rows]
+        out = np.zeros(planes.shape[1], dtype=np.uint16)
+
+        for start in range(0, len(out), BINARY_BLOCK_ROWS):
+            end = min(start + BINARY_BLOCK_ROWS, len(out))
+            for w, word in enumerate(q_code):
+                out[start:end] += popcount(planes[w, start:end] ^ word)
+
+        return out
+
+    def search(self, q_emb, top_k, rescore=None, mask=None, **_):
+        q_emb = np.asarray(q_emb, dtype=np.float32)
+        rows = eligible_rows(mask)
+
+        dist = self.distances(binarize(q_emb), rows)
+        shortlist = max(top_k * (rescore or self.rescore), BINARY_MIN_SHORTLIST)
+        shortlist = min(shortlist, len(dist))
+
+        if shortlist <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        cand = np.argpartition(dist, shortlist - 1)[:shortlist]
+        if rows is not None:
+            cand = rows[cand]
+        cand.sort()
+
+        scores = self.embeddings.gather_scores(cand, q_emb)
+        best = top_k_desc(scores, top_k)
+        return cand[best], scores[best]
+
+    def search_batch(self, q_embs, top_k, rescore=None, mask=None, **_):
+        return [self.search(q, top_k, rescore=rescore, mask=mask) for q in q_embs]
+
+    def save(self, embeddings_file, source=None):
+        paths = binary_paths(embeddings_file)
+        atomic_save(paths["codes"], self.planes)
+        meta = {"n_rows": len(self), "dim": self.embeddings.dim, "source": source}
+        paths["meta"].write_text(json.dumps(meta))
+
+    @classmethod
+    def load(
+        cls, embeddings, embeddings_file, rescore=BINARY_RESCORE_FACTOR, source=None
+    ):
+        paths = binary_paths(embeddings_file)
+        if not all(p.exists() for p in paths.values()):
+            return None
+
+        meta = json.loads(paths["meta"].read_text())
+        if meta["n_rows"] != len(embeddings) or meta.get("source") != source:
+            print("[WARN] Binary codes are stale (embeddings changed). Ignoring them.")
+            return None
+
+        return cls(embeddings, np.load(paths["codes"], mmap_mode="r"), rescore=rescore)
+
+
+# -------------------------------
+# REDUCED DIMENSION (PCA / MATRYOSHKA)
+# -------------------------------
+def reduced_paths(embeddings_file, dim):
+    stem = Path(embeddings_file).with_suffix("")
+    name = f"{stem.name}.reduced{dim}"
+    return {
+        "meta": stem.with_name(f"{name}.json"),
+        "matrix": stem.with_name(f"{name}.npy"),
+        "mean": stem.with_name(f"{name}.mean.npy"),
+        "components": stem.with_name(f"{name}.components.npy"),
+    }
+
+
+def fit_pca(store, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    n = len(store)
+    picks = rng.choice(n, size=min(n, PCA_SAMPLE_ROWS), replace=False)
+    sample = store[np.sort(picks)]
+
+    mean = sample.mean(axis=0)
+    centered = sample - mean
+    eigvals, eigvecs = np.linalg.eigh(centered.T @ centered)
+    components = eigvecs[:, np.argsort(eigvals)[::-1][:dim]]
+
+    return mean.astype(np.float32), components.astype(np.float32)
+
+
+class ReducedIndex:
+    kind = "reduced"
+
+    # x . q = mean . q + ((x - mean) P) . (q P) up to the discarded
+    # components, and mean . q is constant per query, so rows are ranked by
+    # the reduced dot product. Truncation instead renormalizes the prefix.
+    def __init__(
+        self,
+        embeddings,
+        matrix,
+        mean,
+        components,
+        method="pca",
+        rescore=REDUCED_RESCORE_FACTOR,
+    ):
+        self.embeddings = as_embedding_store(embeddings)
+        self.matrix = matrix
+        self.mean = mean
+        self.components = components
+        self.method = method
+        self.rescore = rescore
+
+        if len(matrix) != len(self.embeddings):
+            raise RuntimeError("Reduced index and embeddings length mismatch")
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    @classmethod
+    def build(
+        cls,
+        embeddings,
+        dim=REDUCED_DEFAULT_DIM,
+        method="pca",
+        rescore=REDUCED_RESCORE_FACTOR,
+    ):
+        store = as_embedding_store(embeddings)
+        if method not in REDUCED_METHODS:
+            raise ValueError(f"Unsupported reduction method: {method}")
+        dim = min(dim, store.dim)
+
+        if method == "pca":
+            mean, components = fit_pca(store, dim)
+        else:
+            mean = np.zeros(store.dim, dtype=np.float32)
+            components = np.eye(store.dim, dim, dtype=np.float32)
+
+        index = cls(
+            store,
+            np.empty((len(store), dim), dtype=np.float32),
+            mean,
+            components,
+            method=method,
+            rescore=rescore,
+        )
+        for start in range(0, len(store), IVF_ASSIGN_BLOCK_ROWS):
+            end = min(start + IVF_ASSIGN_BLOCK_ROWS, len(store))
+            index.matrix[start:end] = index.project(store[start:end], rows=True)
+
+        return index
+
+    def project(self, x, rows=False):
+        # rows are centered before projecting; queries are not (see above)
+        x = np.asarray(x, dtype=np.float32)
+        reduced = (x - self.mean if rows else x) @ self.components
+
+        if self.method == "truncate":
+            norms = np.linalg.norm(reduced, axis=-1, keepdims=True)
+            reduced = reduced / np.where(norms > 0, norms, 1)
+        return reduced
+
+    def search(self, q_emb, top_k, rescore=None, mask=None, **_):
+        return self.search_batch(
+            np.asarray(q_emb)[None, :], top_k, rescore=rescore, mask=mask
+        )[0]
+
+    def search_batch(self, q_embs, top_k, rescore=None, mask=None, **_):
+        q_embs = np.asarray(q_embs, dtype=np.float32)
+        rows = eligible_rows(mask)
+        matrix = self.matrix if rows is None else self.matrix[rows]
+
+        rescore = self.rescore if rescore is None else rescore
+        shortlist = top_k * rescore if rescore else top_k
+
+        results = []
+        for start in range(0, len(q_embs), QUERY_BLOCK):
+            block = q_embs[start : start + QUERY_BLOCK]
+            block_scores = self.project(block) @ matrix.T
+
+            for q_emb, scores in zip(block, block_scores):
+                cand = top_k_desc(scores, shortlist)
+                if not rescore:
+                    idx = cand if rows is None else rows[cand]
+                    results.append((idx, scores[cand] + self.mean @ q_emb))
+                    continue
+
+                cand = np.sort(cand if rows is None else rows[cand])
+                full = self.embeddings.gather_scores(cand, q_emb)
+                best = top_k_desc(full, top_k)
+                results.append((cand[best], full[best]))
+
+        return results
+
+    def save(self, embeddings_file, source=None):
+        paths = reduced_paths(embeddings_file, self.dim)
+
+        atomic_save(paths["matrix"], self.matrix)
+        atomic_save(paths["mean"], self.mean)
+        atomic_save(paths["components"], self.components)
+        meta = {
+            "n_rows": len(self),
+            "dim": self.dim,
+            "method": self.method,
+            "source": source,
+        }
+        paths["meta"].write_text(json.dumps(meta))
+
+    @classmethod
+    def load(
+        cls,
+        embeddings,
+        embeddings_file,
+        dim=REDUCED_DEFAULT_DIM,
+        method="pca",
+        rescore=REDUCED_RESCORE_FACTOR,
+        source=None,
+    ):
+        paths = reduced_paths(embeddings_file, dim)
+        if not all(p.exists() for p in paths.values()):
+            return None
+
+        meta = json.loads(paths["meta"].read_text())
+        if meta["method"] != method:
+            return None
+        if meta["n_rows"] != len(embeddings) or meta.get("source") != source:
+            print("[WARN] Reduced index is stale (embeddings changed). Ignoring it.")
+            return None
+
+        return cls(
+            embeddings,
+            np.load(paths["matrix"], mmap_mode="r"),
+            np.load(paths["mean"]),
+            np.load(paths["components"]),
+            method=method,
+            rescore=rescore,
+        )
+
+
+# -------------------------------
+# LOAD OR BUILD
+# -------------------------------
+def load_dense_index(
+    embeddings,
+    embeddings_file,
+    kind="exact",
+    nprobe=IVF_DEFAULT_NPROBE,
+    rescore=None,
+    reduced_dim=REDUCED_DEFAULT_DIM,
+    reduced_method="pca",
+    source=None,
+):
+    # source identifies the embeddings the index was built from (e.g. file
+    # signature); a persisted index with a different source is rebuilt
+    if kind == "exact":
+        return ExactIndex(embeddings)
+
+    if kind == "ivf":
+        index = IVFFlatIndex.load(embeddings, embeddings_file, nprobe, source=source)
+        if index is None:
+            print("[INFO] Building IVF index from embeddings...")
+            index = IVFFlatIndex.build(embeddings, nprobe=nprobe)
+            index.save(embeddings_file, source=source)
+        return index
+
+    if kind == "binary":
+        rescore = BINARY_RESCORE_FACTOR if rescore is None else rescore
+        index = BinaryIndex.load(embeddings, embeddings_file, rescore, source=source)
+        if index is None:
+            print("[INFO] Building binary codes from embeddings...")
+            index = BinaryIndex.build(embeddings, rescore=rescore)
+            index.save(embeddings_file, source=source)
+        return index
+
+    if kind == "reduced":
+        rescore = REDUCED_RESCORE_FACTOR if rescore is None else rescore
+        index = ReducedIndex.load(
+            embeddings,
+            embeddings_file,
+            reduced_dim,
+            reduced_method,
+            rescore,
+            source=source,
+        )
+        if index is None:
+            print(f"[INFO] Building {reduced_method} reduced index ({reduced_dim}d)...")
+            index = ReducedIndex.build(
+                embeddings, reduced_dim, reduced_method, rescore=rescore
+            )
+            index.save(embeddings_file, source=source)
+        return index
+
+    raise ValueError(f"Unknown dense index kind: {kind}")
+
+
+if __name__ == "__main__":
+    from src.search.semantic_search import EMBEDDINGS_FILE
+    from src.search.embedding_store import load_embedding_store
+
+    store = load_embedding_store(EMBEDDINGS_FILE, "float32")
+    exact = ExactIndex(store)
+
+    index = IVFFlatIndex.build(store)
+    index.save(EMBEDDINGS_FILE)
+    print(f"IVF built: {len(index)} rows, nlist={index.nlist}")
+
+    rng = np.random.default_rng(0)
+    queries = store[rng.choice(len(store), size=min(200, len(store)), replace=False)]
+    k = 10
+    truth = [set(exact.search(q, k)[0]) for q in queries]
+
+    for nprobe in (1, 4, 8, 16, 32):
+        hits = 0
+        start = time.perf_counter()
+        for q, t in zip(queries, truth):
+            found, _ = index.search(q, k, nprobe=nprobe)
+            hits += len(set(found) & t)
+        elapsed = (time.perf_counter() - start) / len(queries)
+        print(
+            f"nprobe={nprobe:<3} recall@{k}={hits / (len(queries) * k):.4f} "
+            f"| {elapsed * 1e3:.2f} ms/query"
+        )
+
+    binary = BinaryIndex.build(store)
+    binary.save(EMBEDDINGS_FILE)
+    print(f"Binary codes: {binary.planes.nbytes / 1e6:.1f} MB")
+
+    for rescore in (1, 4, 10, 40):
+        hits = 0
+        start = time.perf_counter()
+        for q, t in zip(queries, truth):
+            found, _ = binary.search(q, k, rescore=rescore)
+            hits += len(set(found) & t)
+        elapsed = (time.perf_counter() - start) / len(queries)
+        print(
+            f"rescore={rescore:<3} recall@{k}={hits / (len(queries) * k):.4f} "
+            f"| {elapsed * 1e3:.2f} ms/query"
+        )
+
+    for dim in (64, 128):
+        reduced = ReducedIndex.build(store, dim)
+        reduced.save(EMBEDDINGS_FILE)
+        for rescore in (0, 10):
+            hits = 0
+            start = time.perf_counter()
+            for q, t in zip(queries, truth):
+                found, _ = reduced.search(q, k, rescore=rescore)
+                hits += len(set(found) & t)
+            elapsed = (time.perf_counter() - start) / len(queries)
+            print(
+                f"pca{dim} rescore={rescore:<3} "
+                f"recall@{k}={hits / (len(queries) * k):.4f} "
+                f"| {elapsed * 1e3:.2f} ms/query"
+            )
@@ -0,0 +1,124 @@
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+DEFAULT_WINDOW_MS = 3.0
+DEFAULT_MAX_BATCH = 32
+
+
+# -------------------------------
+# MICRO-BATCHER
+# -------------------------------
+class MicroBatcher:
+    # coalesces concurrent encode calls: the first query opens a window of
+    # window_ms, everything arriving in it (up to max_batch) is encoded in
+    # one forward pass and each caller gets its own row back
+    def __init__(
+        self, encode_fn, window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH
+    ):
+        self.encode_fn = encode_fn
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._queries = 0
+        self._largest = 0
+        self._closed = False
+
+        self._worker = threading.Thread(
+            target=self._run, name="query-micro-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def encode(self, texts):
+        texts = list(texts)
+
+        # already a full batch: nothing to gain from waiting
+        if len(texts) >= self.max_batch:
+            return self.encode_fn(texts)
+
+        # queued under the lock so nothing lands behind close()'s sentinel;
+        # once closed the worker is gone and the caller encodes directly
+        futures = []
+        with self._lock:
+            if self._closed:
+                return self.encode_fn(texts)
+            for text in texts:
+                future = Future()
+                self._queue.put((text, future))
+                futures.append(future)
+
+        return np.stack([f.result() for f in futures])
+
+    def stats(self):
+        with self._lock:
+            batches, queries = self._batches, self._queries
+            return {
+                "window_ms": self.window * 1000.0,
+                "max_batch": self.max_batch,
+                "batches": batches,
+                "queries": queries,
+                "avg_batch_size": queries / batches if batches else 0.0,
+                "largest_batch": self._largest,
+            }
+
+    def close(self):
+        # the worker exits after serving what is already queued; later
+        # encode calls run inline
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            texts = [text for text, _ in batch]
+
+            try:
+                embeddings = self.encode_fn(texts)
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+
+            for (_, future), emb in zip(batch, embeddings):
+                future.set_result(emb)
+
+            with self._lock:
+                self._batches += 1
+                self._queries += len(batch)
+                self._largest = max(self._largest, len(batch))
@@ -0,0 +1,328 @@
+import json
+import os
+import numpy as np
+from collections import Counter
+from pathlib import Path
+
+from src.search.embedding_store import replace_dir
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+# same defaults as rank_bm25.BM25Okapi so scores stay comparable
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+
+def tokenize(text):
+    return text.lower().split()
+
+
+# -------------------------------
+# INVERTED INDEX
+# -------------------------------
+class InvertedBM25:
+    # postings are CSR-style: the documents containing term t are
+    # doc_ids[indptr[t]:indptr[t + 1]], with their precomputed BM25
+    # term weight in the matching slice of weights
+    def __init__(self, vocab, idf, indptr, doc_ids, weights, doc_len, row_ids):
+        self.vocab = vocab
+        self.idf = idf
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.doc_len = doc_len
+        self.row_ids = row_ids
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, texts, row_ids, k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON):
+        vocab = {}
+        term_ids = []
+        doc_ids = []
+        tfs = []
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+
+        for d, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len[d] = len(tokens)
+
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(d)
+                tfs.append(tf)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+        tfs = np.asarray(tfs, dtype=np.float32)[order]
+
+        df = np.bincount(term_ids, minlength=len(vocab))
+        indptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+
+        n_docs = len(texts)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        idf[idf < 0] = epsilon * idf.mean() if len(idf) else 0.0
+        idf = idf.astype(np.float32)
+
+        avgdl = doc_len.mean() if n_docs else 0.0
+        norm = k1 * (1 - b + b * doc_len / avgdl) if avgdl else np.full(n_docs, k1)
+
+        posting_idf = np.repeat(idf, df)
+        weights = posting_idf * tfs * (k1 + 1) / (tfs + norm[doc_ids])
+
+        return cls(
+            vocab,
+            idf,
+            indptr,
+            doc_ids,
+            weights.astype(np.float32),
+            doc_len,
+            np.asarray(row_ids, dtype=np.int64),
+        )
+
+    def subset(self, docs):
+        # postings restricted to docs (renumbered 0..len(docs)-1); idf and the
+        # precomputed weights are kept, so scores match the full index
+        docs = np.asarray(docs, dtype=np.int64)
+        remap = np.full(len(self), -1, dtype=np.int64)
+        remap[docs] = np.arange(len(docs))
+
+        n_terms = len(self.indptr) - 1
+        terms = np.repeat(np.arange(n_terms), np.diff(self.indptr))
+        new_docs = remap[self.doc_ids]
+        keep = new_docs >= 0
+
+        counts = np.bincount(terms[keep], minlength=n_terms)
+        indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        return InvertedBM25(
+            self.vocab,
+            self.idf,
+            indptr,
+            new_docs[keep].astype(np.int32),
+            np.asarray(self.weights)[keep],
+            np.asarray(self.doc_len)[docs],
+            np.asarray(self.row_ids)[docs],
+        )
+
+    def term_ids(self, tokens):
+        # repeated query tokens count once per occurrence, as in BM25Okapi
+        ids = (self.vocab.get(t) for t in tokens)
+        return [i for i in ids if i is not None]
+
+    def match(self, tokens):
+        ids = self.term_ids(tokens)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        docs = np.concatenate(
+            [self.doc_ids[self.indptr[t] : self.indptr[t + 1]] for t in ids]
+        )
+        weights = np.concatenate(
+            [self.weights[self.indptr[t] : self.indptr[t + 1]] for t in ids]
+        )
+
+        matched, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights).astype(np.float32)
+        return matched.astype(np.int64), scores
+
+    def top_n(self, tokens, n, mask=None):
+        docs, scores = self.match(tokens)
+        return _select_top(docs, scores, n, mask)
+
+    def top_n_batch(self, token_lists, n, mask=None):
+        return [
+            _select_top(docs, scores, n, mask)
+            for docs, scores in self.match_batch(token_lists)
+        ]
+
+    def match_batch(self, token_lists):
+        # one postings gather for all queries: documents are keyed by
+        # (query, doc) so a single unique/bincount accumulates every query
+        n_docs = len(self)
+        keys = []
+        weights = []
+
+        for qi, tokens in enumerate(token_lists):
+            for t in self.term_ids(tokens):
+                start, end = self.indptr[t], self.indptr[t + 1]
+                keys.append(self.doc_ids[start:end].astype(np.int64) + qi * n_docs)
+                weights.append(self.weights[start:end])
+
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if not keys:
+            return [empty for _ in token_lists]
+
+        matched, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights)).astype(np.float32)
+
+        bounds = np.searchsorted(matched // n_docs, np.arange(len(token_lists) + 1))
+        docs = matched % n_docs
+
+        return [
+            (docs[lo:hi], scores[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:])
+        ]
+
+    def get_scores(self, tokens):
+        scores = np.zeros(len(self), dtype=np.float32)
+        docs, matched = self.match(tokens)
+        scores[docs] = matched
+        return scores
+
+
+def _select_top(docs, scores, n, mask=None):
+    # mask is a per-document boolean filter; ineligible matches never compete
+    if mask is not None:
+        keep = mask[docs]
+        docs, scores = docs[keep], scores[keep]
+
+    if len(docs) > n:
+        keep = np.argpartition(-scores, n - 1)[:n]
+        docs, scores = docs[keep], scores[keep]
+
+    order = np.argsort(-scores, kind="stable")
+    return docs[order], scores[order]
+
+
+# -------------------------------
+# PERSISTED ARTIFACT
+# -------------------------------
+# bump when the on-disk layout changes; older artifacts are rebuilt
+BM25_FORMAT_VERSION = 1
+
+BM25_ARRAYS = (
+    "indptr",
+    "doc_ids",
+    "weights",
+    "doc_len",
+    "row_ids",
+    "idf",
+    "vocab_offsets",
+    "vocab_bytes",
+)
+
+
+class MmapVocab:
+    # sorted UTF-8 terms packed into one byte buffer; term id == sort position,
+    # looked up by binary search so no per-term Python objects are created
+    def __init__(self, offsets, buffer):
+        self.offsets = offsets
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def term(self, i):
+        return bytes(self.buffer[self.offsets[i] : self.offsets[i + 1]])
+
+    def get(self, term, default=None):
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(self) and self.term(lo) == key:
+            return lo
+        return default
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __getitem__(self, term):
+        i = self.get(term)
+        if i is None:
+            raise KeyError(term)
+        return i
+
+
+def _sorted_layout(index):
+    # renumber terms in byte order so the vocabulary can be binary searched
+    terms = sorted(index.vocab, key=lambda t: t.encode("utf-8"))
+    old = np.array([index.vocab[t] for t in terms], dtype=np.int64)
+
+    lengths = np.diff(index.indptr)[old]
+    indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    src = np.repeat(index.indptr[old] - indptr[:-1], lengths) + np.arange(indptr[-1])
+
+    encoded = [t.encode("utf-8") for t in terms]
+    vocab_offsets = np.concatenate(
+        [[0], np.cumsum([len(t) for t in encoded], dtype=np.int64)]
+    ).astype(np.int64)
+    vocab_bytes = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    return {
+        "indptr": indptr,
+        "doc_ids": index.doc_ids[src],
+        "weights": index.weights[src],
+        "doc_len": index.doc_len,
+        "row_ids": index.row_ids,
+        "idf": index.idf[old],
+        "vocab_offsets": vocab_offsets,
+        "vocab_bytes": vocab_bytes,
+    }
+
+
+def save_bm25_index(index, index_dir, source=None):
+    index_dir = Path(index_dir)
+    tmp_dir = index_dir.with_name(f"{index_dir.name}.tmp-{os.getpid()}")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    arrays = _sorted_layout(index)
+    for name in BM25_ARRAYS:
+        np.save(tmp_dir / f"{name}.npy", arrays[name])
+
+    header = {
+        "format_version": BM25_FORMAT_VERSION,
+        "n_docs": len(index),
+        "n_terms": len(index.vocab),
+        "n_postings": int(len(index.doc_ids)),
+        "source": source or {},
+    }
+    (tmp_dir / "header.json").write_text(json.dumps(header, indent=2))
+
+    # swap the finished directory in so readers never see a partial artifact
+    replace_dir(tmp_dir, index_dir)
+
+
+def read_bm25_header(index_dir):
+    header_file = Path(index_dir) / "header.json"
+    if not header_file.exists():
+        return None
+    return json.loads(header_file.read_text())
+
+
+def load_bm25_index(index_dir, mmap=True):
+    index_dir = Path(index_dir)
+    header = read_bm25_header(index_dir)
+
+    if header is None or header.get("format_version") != BM25_FORMAT_VERSION:
+        return None
+
+    mmap_mode = "r" if mmap else None
+    arrays = {
+        name: np.load(index_dir / f"{name}.npy", mmap_mode=mmap_mode)
+        for name in BM25_ARRAYS
+    }
+
+    if len(arrays["row_ids"]) != header["n_docs"]:
+        raise RuntimeError("BM25 artifact header and row_ids length mismatch")
+
+    return InvertedBM25(
+        MmapVocab(arrays["vocab_offsets"], arrays["vocab_bytes"]),
+        arrays["idf"],
+        arrays["indptr"],
+        arrays["doc_ids"],
+        arrays["weights"],
+        arrays["doc_len"],
+        arrays["row_ids"],
+    )
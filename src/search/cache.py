@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+DEFAULT_QUERY_CACHE_ENTRIES = 4096
+DEFAULT_RESULT_CACHE_ENTRIES = 10000
+
+# how often the index version is re-read to detect changed artifacts
+VERSION_CHECK_INTERVAL = 1.0
+
+
+def normalize_query(query):
+    # the MiniLM tokenizer is uncased, so case and spacing do not change the embedding
+    return " ".join(query.lower().split())
+
+
+# -------------------------------
+# QUERY EMBEDDING CACHE
+# -------------------------------
+class QueryEmbeddingCache:
+    # LRU of normalized query text -> query embedding, bounded by entry
+    # count and optionally by total embedding bytes
+    def __init__(self, max_entries=DEFAULT_QUERY_CACHE_ENTRIES, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, query):
+        key = normalize_query(query)
+        with self._lock:
+            emb = self._entries.get(key)
+            if emb is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return emb
+
+    def put(self, query, emb):
+        key = normalize_query(query)
+        emb = emb.copy()
+        emb.setflags(write=False)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+
+            self._entries[key] = emb
+            self._bytes += emb.nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            _, emb = self._entries.popitem(last=False)
+            self._bytes -= emb.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# -------------------------------
+# SEARCH RESULT CACHE
+# -------------------------------
+class ResultCache:
+    # LRU of (normalized query, mode, params) -> formatted result list.
+    # Entries belong to one index version: when version_fn reports a new
+    # version (DB or embedding artifacts changed) the cache is dropped.
+    def __init__(
+        self,
+        version_fn,
+        max_entries=DEFAULT_RESULT_CACHE_ENTRIES,
+        persist_path=None,
+    ):
+        self.version_fn = version_fn
+        self.max_entries = max_entries
+        self.persist_path = Path(persist_path) if persist_path else None
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = version_fn()
+        self._checked_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        if self.persist_path is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(query, mode, params):
+        return json.dumps(
+            [normalize_query(query), mode, params], sort_keys=True, default=str
+        )
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+
+        self._checked_at = now
+        version = self.version_fn()
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+            self.invalidations += 1
+
+    def get(self, query, mode, params):
+        key = self.make_key(query, mode, params)
+        with self._lock:
+            self._check_version()
+
+            results = self._entries.get(key)
+            if results is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return [dict(r) for r in results]
+
+    def put(self, query, mode, params, results):
+        key = self.make_key(query, mode, params)
+        with self._lock:
+            self._entries[key] = [dict(r) for r in results]
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "index_version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    # ---- persistence (warm restarts) ----
+    def save(self):
+        if self.persist_path is None:
+            return
+
+        with self._lock:
+            entries = list(self._entries.items())
+
+        payload = {"version": self.version, "entries": entries}
+        tmp = self.persist_path.with_name(
+            f"{self.persist_path.name}.tmp-{os.getpid()}"
+        )
+        tmp.write_text(json.dumps(payload))
+        os.replace(tmp, self.persist_path)
+
+    def load(self):
+        if self.persist_path is None or not self.persist_path.exists():
+            return
+
+        try:
+            payload = json.loads(self.persist_path.read_text())
+        except (OSError, ValueError):
+            print(f"[WARN] Unreadable result cache at {self.persist_path}. Ignoring.")
+            return
+
+        # a cache written against other artifacts is useless
+        if payload.get("version") != self.version:
+            return
+
+        with self._lock:
+            for key, results in payload["entries"][-self.max_entries :]:
+                self._entries[key] = results
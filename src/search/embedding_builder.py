@@ -0,0 +1,208 @@
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from src.search.encoder import load_encoder
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+DEFAULT_CHUNK_SIZE = 2048
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_TORCH_THREADS = 2
+
+BUILD_FORMAT_VERSION = 1
+
+
+def default_workers(torch_threads=DEFAULT_TORCH_THREADS):
+    return max(1, (os.cpu_count() or 1) // torch_threads)
+
+
+# -------------------------------
+# WORKER
+# -------------------------------
+_worker_model = None
+
+
+def _init_worker(model_name, torch_threads, backend):
+    import torch
+
+    # bounded intra-op threads so N workers do not oversubscribe the cores
+    torch.set_num_threads(torch_threads)
+
+    global _worker_model
+    _worker_model = load_encoder(model_name, "cpu", backend)
+
+
+def plain_encode(model, texts, batch_size):
+    # encode_fn contract: (model, texts, batch_size) -> (embeddings, n_tokens)
+    embeddings = model.encode(
+        texts,
+        batch_size=batch_size,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    )
+    return np.asarray(embeddings, dtype=np.float32), None
+
+
+def _encode_chunk(chunk_id, texts, batch_size, encode_fn):
+    return (chunk_id, *encode_fn(_worker_model, texts, batch_size))
+
+
+# -------------------------------
+# CHECKPOINT
+# -------------------------------
+def build_paths(out_file):
+    out_file = Path(out_file)
+    stem = out_file.with_suffix("")
+    return (
+        stem.with_name(f"{stem.name}.build.npy"),
+        stem.with_name(f"{stem.name}.build.json"),
+    )
+
+
+def job_fingerprint(texts, model_name, chunk_size, backend="torch"):
+    digest = hashlib.blake2b(digest_size=16)
+    header = f"{model_name}\0{backend}\0{chunk_size}\0{len(texts)}\0"
+    digest.update(header.encode("utf-8"))
+    for t in texts:
+        digest.update(t.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _read_checkpoint(checkpoint_file, job):
+    if not checkpoint_file.exists():
+        return None
+
+    state = json.loads(checkpoint_file.read_text())
+    if state.get("format_version") != BUILD_FORMAT_VERSION or state.get("job") != job:
+        return None
+    return state
+
+
+def _write_checkpoint(checkpoint_file, state):
+    tmp = checkpoint_file.with_name(f"{checkpoint_file.name}.tmp")
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, checkpoint_file)
+
+
+# -------------------------------
+# BUILDER
+# -------------------------------
+def build_embeddings(
+    texts,
+    out_file,
+    model_name,
+    workers=1,
+    torch_threads=DEFAULT_TORCH_THREADS,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    batch_size=DEFAULT_BATCH_SIZE,
+    device="cpu",
+    encode_fn=plain_encode,
+    backend="torch",
+    model=None,
+):
+    # Encodes texts chunk by chunk into a preallocated .npy memmap next to
+    # out_file. Finished chunks are checkpointed, so rerunning the same job
+    # after a crash only encodes the missing chunks. Returns the memmap path.
+    # model: the encoder already loaded for device/backend, used in-process
+    # instead of loading another one when workers <= 1.
+    matrix_file, checkpoint_file = build_paths(out_file)
+    n = len(texts)
+    chunks = [
+        (c, lo, min(lo + chunk_size, n))
+        for c, lo in enumerate(range(0, n, chunk_size))
+    ]
+
+    job = job_fingerprint(texts, model_name, chunk_size, backend)
+    state = _read_checkpoint(checkpoint_file, job)
+    if state is not None and matrix_file.exists():
+        print(
+            f"[INFO] Resuming embedding build: "
+            f"{len(state['done'])}/{len(chunks)} chunks done"
+        )
+        matrix = np.load(matrix_file, mmap_mode="r+")
+    else:
+        state = {
+            "format_version": BUILD_FORMAT_VERSION,
+            "job": job,
+            "done": [],
+            "dim": None,
+        }
+        matrix = None
+
+    done = set(state["done"])
+    todo = [c for c in chunks if c[0] not in done]
+
+    started = time.perf_counter()
+    encoded = 0
+    tokens = 0
+
+    def store(chunk_id, emb, n_tokens):
+        nonlocal matrix, encoded, tokens
+        if matrix is None:
+            state["dim"] = int(emb.shape[1])
+            matrix = np.lib.format.open_memmap(
+                matrix_file, mode="w+", dtype=np.float32, shape=(n, state["dim"])
+            )
+
+        _, lo, hi = chunks[chunk_id]
+        matrix[lo:hi] = emb
+        matrix.flush()
+
+        state["done"].append(chunk_id)
+        _write_checkpoint(checkpoint_file, state)
+
+        encoded += hi - lo
+        tokens += n_tokens or 0
+        print(f"[INFO] chunk {chunk_id + 1}/{len(chunks)} | {throughput()}")
+
+    def throughput():
+        elapsed = time.perf_counter() - started
+        report = f"{encoded / elapsed:.1f} texts/sec"
+        if tokens:
+            report += f", {tokens / elapsed:.0f} tokens/sec"
+        return report
+
+    if workers <= 1 and todo:
+        if model is None:
+            model = load_encoder(model_name, device, backend)
+        for chunk_id, lo, hi in todo:
+            store(chunk_id, *encode_fn(model, texts[lo:hi], batch_size))
+    elif todo:
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(model_name, torch_threads, backend),
+        ) as pool:
+            futures = [
+                pool.submit(
+                    _encode_chunk, chunk_id, texts[lo:hi], batch_size, encode_fn
+                )
+                for chunk_id, lo, hi in todo
+            ]
+            for future in as_completed(futures):
+                store(*future.result())
+
+    if matrix is None:
+        raise RuntimeError("Embedding build produced no output")
+
+    if encoded:
+        print(f"[INFO] Encoded {encoded} texts | {throughput()}")
+
+    matrix.flush()
+    return matrix_file
+
+
+def clear_build(out_file):
+    for path in build_paths(out_file):
+        path.unlink(missing_ok=True)
@@ -0,0 +1,244 @@
+import os
+import shutil
+import time
+import numpy as np
+from pathlib import Path
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+STORE_DTYPES = ("float32", "float16", "int8")
+
+# rows upcast to float32 per block when scoring quantized layouts,
+# so a query never materializes a full float32 copy of the matrix
+SCORE_BLOCK_ROWS = 65536
+
+
+# -------------------------------
+# FILE LAYOUT
+# -------------------------------
+def store_paths(embeddings_file, dtype):
+    embeddings_file = Path(embeddings_file)
+
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"Unsupported embedding store dtype: {dtype}")
+
+    if dtype == "float32":
+        return embeddings_file, None
+
+    stem = embeddings_file.with_suffix("")
+    matrix_file = stem.with_name(f"{stem.name}.{dtype}.npy")
+    scales_file = (
+        stem.with_name(f"{stem.name}.{dtype}.scales.npy") if dtype == "int8" else None
+    )
+    return matrix_file, scales_file
+
+
+# -------------------------------
+# QUANTIZATION
+# -------------------------------
+def quantize_int8(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+
+    codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def convert_embeddings(embeddings, dtype):
+    if dtype == "float32":
+        return np.asarray(embeddings, dtype=np.float32), None
+    if dtype == "float16":
+        return np.asarray(embeddings, dtype=np.float16), None
+    if dtype == "int8":
+        return quantize_int8(embeddings)
+
+    raise ValueError(f"Unsupported embedding store dtype: {dtype}")
+
+
+# -------------------------------
+# STORE
+# -------------------------------
+class EmbeddingStore:
+    def __init__(self, matrix, scales=None):
+        if matrix.ndim != 2:
+            raise ValueError("Embedding matrix must be 2-dimensional")
+        if scales is not None and len(scales) != len(matrix):
+            raise RuntimeError("Embedding scales and matrix length mismatch")
+
+        self.matrix = matrix
+        self.scales = scales
+        self.dtype = str(matrix.dtype)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    @property
+    def nbytes(self):
+        total = self.matrix.nbytes
+        if self.scales is not None:
+            total += self.scales.nbytes
+        return total
+
+    def __getitem__(self, idx):
+        rows = np.asarray(self.matrix[idx], dtype=np.float32)
+        if self.scales is not None:
+            scales = self.scales[idx]
+            rows = rows * (scales[..., None] if np.ndim(scales) else scales)
+        return rows
+
+    def scores(self, q_emb):
+        # q_emb is a single (d,) query or an (m, d) batch; returns (n,) or (m, n)
+        q = np.asarray(q_emb, dtype=np.float32)
+
+        if self.dtype == "float32":
+            return self.matrix @ q if q.ndim == 1 else q @ self.matrix.T
+
+        n = len(self.matrix)
+        out = np.empty((n,) if q.ndim == 1 else (n, len(q)), dtype=np.float32)
+
+        for start in range(0, n, SCORE_BLOCK_ROWS):
+            end = min(start + SCORE_BLOCK_ROWS, n)
+            block = self.matrix[start:end].astype(np.float32)
+            out[start:end] = block @ q if q.ndim == 1 else block @ q.T
+
+        if self.scales is not None:
+            out *= self.scales if q.ndim == 1 else self.scales[:, None]
+
+        return out if q.ndim == 1 else out.T
+
+    def gather_scores(self, indices, q_emb):
+        return self[np.asarray(indices, dtype=np.int64)] @ np.asarray(
+            q_emb, dtype=np.float32
+        )
+
+
+def as_embedding_store(embeddings):
+    if isinstance(embeddings, EmbeddingStore):
+        return embeddings
+    return EmbeddingStore(np.asarray(embeddings, dtype=np.float32))
+
+
+# -------------------------------
+# SAVE / LOAD
+# -------------------------------
+def atomic_save(path, array):
+    # readers may have the old file memory-mapped, so never rewrite in place
+    tmp = path.with_name(f"{path.stem}.tmp-{os.getpid()}.npy")
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+def replace_dir(tmp_dir, target_dir):
+    # Swaps a finished artifact directory in. A directory cannot be renamed
+    # over another one, so target_dir is a symlink to a versioned directory
+    # and only the link is replaced: readers always find the old or the new
+    # artifact, never neither. The replaced version is kept until the next
+    # swap, so a reader that resolved the old link can still open its files.
+    tmp_dir, target_dir = Path(tmp_dir), Path(target_dir)
+    version_dir = target_dir.with_name(f"{target_dir.name}.v{time.time_ns()}")
+    os.replace(tmp_dir, version_dir)
+
+    link = target_dir.with_name(f"{target_dir.name}.link-{os.getpid()}")
+    try:
+        os.symlink(version_dir.name, link, target_is_directory=True)
+    except OSError:
+        # no symlinks (e.g. Windows without the privilege): swap in two steps
+        link = None
+
+    keep = {version_dir.name}
+    if target_dir.is_symlink():
+        keep.add(os.readlink(target_dir))
+    elif target_dir.exists():
+        # a plain directory (older layout) has to be moved aside first
+        os.replace(target_dir, target_dir.with_name(f"{target_dir.name}.v0"))
+
+    if link is not None:
+        os.replace(link, target_dir)
+    else:
+        os.replace(version_dir, target_dir)
+
+    for old_dir in target_dir.parent.glob(f"{target_dir.name}.v*"):
+        if old_dir.name not in keep:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def save_embedding_store(embeddings, embeddings_file, dtype):
+    matrix, scales = convert_embeddings(embeddings, dtype)
+    matrix_file, scales_file = store_paths(embeddings_file, dtype)
+
+    if scales_file is not None:
+        atomic_save(scales_file, scales)
+    atomic_save(matrix_file, matrix)
+
+    return EmbeddingStore(matrix, scales)
+
+
+def load_embedding_store(embeddings_file, dtype="float32", mmap=True):
+    matrix_file, scales_file = store_paths(embeddings_file, dtype)
+    mmap_mode = "r" if mmap else None
+
+    if not Path(embeddings_file).exists():
+        raise FileNotFoundError(f"Embeddings not found at {embeddings_file}")
+
+    # derived layouts older than book_embeddings.npy are stale
+    needs_convert = dtype != "float32" and (
+        not matrix_file.exists()
+        or (scales_file is not None and not scales_file.exists())
+        or matrix_file.stat().st_mtime_ns < Path(embeddings_file).stat().st_mtime_ns
+    )
+
+    if needs_convert:
+        print(f"[INFO] Building {dtype} embedding store from {embeddings_file}...")
+        reference = np.load(embeddings_file, mmap_mode="r")
+        save_embedding_store(reference, embeddings_file, dtype)
+
+    matrix = np.load(matrix_file, mmap_mode=mmap_mode)
+    scales = np.load(scales_file, mmap_mode=mmap_mode) if scales_file else None
+
+    return EmbeddingStore(matrix, scales)
+
+
+# -------------------------------
+# RECALL CHECK
+# -------------------------------
+def recall_at_k(reference, store, n_queries=200, k=10, seed=0):
+    # queries are perturbed corpus vectors so they have realistic neighbours
+    reference = as_embedding_store(reference)
+    rng = np.random.default_rng(seed)
+
+    picks = rng.choice(len(reference), size=min(n_queries, len(reference)), replace=False)
+    queries = reference[picks] + rng.normal(0, 0.05, (len(picks), reference.dim))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    exact = reference.scores(queries)
+    approx = store.scores(queries)
+
+    k = min(k, len(reference))
+    hits = 0
+    for e, a in zip(exact, approx):
+        truth = set(np.argpartition(-e, k - 1)[:k])
+        found = set(np.argpartition(-a, k - 1)[:k])
+        hits += len(truth & found)
+
+    return hits / (len(picks) * k)
+
+
+if __name__ == "__main__":
+    from src.search.semantic_search import EMBEDDINGS_FILE
+
+    reference = load_embedding_store(EMBEDDINGS_FILE, "float32")
+    print(f"float32: {reference.nbytes / 1e6:.1f} MB")
+
+    for dtype in ("float16", "int8"):
+        store = load_embedding_store(EMBEDDINGS_FILE, dtype)
+        print(
+            f"{dtype}: {store.nbytes / 1e6:.1f} MB "
+            f"| recall@10={recall_at_k(reference, store):.4f}"
+        )
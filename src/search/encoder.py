@@ -0,0 +1,155 @@
+import os
+import time
+import numpy as np
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+# "torch" (full precision), "int8" (torch dynamic quantization of the Linear
+# layers, CPU only) or "onnx" (ONNX Runtime export; needs optimum[onnxruntime]
+# and sentence-transformers >= 3.2)
+ENCODER_BACKENDS = ("torch", "int8", "onnx")
+
+# a non-torch backend is only used if every validation text keeps at least
+# this cosine similarity to the full-precision embedding
+ENCODER_MIN_COSINE = float(os.environ.get("ENCODER_MIN_COSINE", "0.99"))
+
+VALIDATION_TEXTS = [
+    "science fiction",
+    "a history of the roman empire",
+    "learning python programming for beginners",
+    "cozy murder mystery set in a small english village",
+    "poems about love and loss",
+    "The Hobbit J. R. R. Tolkien fantasy adventure dragons dwarves",
+    "introduction to linear algebra with applications; mathematics textbook",
+    "Bildungsroman über eine Kindheit in Berlin",
+]
+
+
+# -------------------------------
+# LOADING
+# -------------------------------
+def load_encoder(model_name, device="cpu", backend="torch"):
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {backend}")
+
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device=device, backend="onnx")
+
+    model = SentenceTransformer(model_name, device=device)
+    if backend == "int8":
+        if device != "cpu":
+            print("[WARN] int8 encoder backend is CPU only. Using torch.")
+            return model
+
+        import torch
+
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return model
+
+
+def encode_normalized(model, texts):
+    embeddings = model.encode(
+        list(texts),
+        batch_size=len(texts),
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    )
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def agreement(a, b):
+    # row-wise cosine between two sets of unit-length embeddings
+    cos = np.sum(a * b, axis=1)
+    return float(cos.min()), float(cos.mean())
+
+
+def cosine_agreement(model, reference, texts=VALIDATION_TEXTS):
+    a = encode_normalized(model, texts)
+    b = encode_normalized(reference, texts)
+    return agreement(a, b)
+
+
+def load_validated_encoder(
+    model_name, device="cpu", backend="torch", validate=True, reference=None
+):
+    # Returns (model, backend actually used). A backend that cannot be loaded
+    # or drifts from full precision falls back to torch. reference is
+    # (texts, embeddings) of stored catalog rows: the backend must reproduce
+    # them. Without it (no embeddings built yet) the backend is compared to
+    # the torch model on VALIDATION_TEXTS.
+    if backend == "torch":
+        return load_encoder(model_name, device), "torch"
+
+    # missing extras surface as ImportError or a plain Exception, and older
+    # sentence-transformers reject backend= with TypeError
+    try:
+        model = load_encoder(model_name, device, backend)
+    except Exception as exc:
+        print(f"[WARN] {backend} encoder backend unavailable ({exc}). Using torch.")
+        return load_encoder(model_name, device), "torch"
+
+    if not validate:
+        return model, backend
+
+    torch_model = None
+    if reference is not None:
+        texts, expected = reference
+        worst, mean = agreement(encode_normalized(model, texts), expected)
+        against = f"{len(texts)} stored embeddings"
+    else:
+        torch_model = load_encoder(model_name, device)
+        worst, mean = cosine_agreement(model, torch_model)
+        against = "torch"
+
+    print(
+        f"[INFO] {backend} encoder vs {against}: "
+        f"cosine min {worst:.4f}, mean {mean:.4f}"
+    )
+    if worst < ENCODER_MIN_COSINE:
+        print(
+            f"[WARN] {backend} encoder below ENCODER_MIN_COSINE "
+            f"({ENCODER_MIN_COSINE}). Using torch."
+        )
+        if torch_model is None:
+            torch_model = load_encoder(model_name, device)
+        return torch_model, "torch"
+
+    return model, backend
+
+
+# -------------------------------
+# BENCHMARK
+# -------------------------------
+if __name__ == "__main__":
+    from src.search.semantic_search import EMBEDDING_MODEL_NAME, default_device
+
+    device = default_device()
+    queries = VALIDATION_TEXTS * 8
+    reference = load_encoder(EMBEDDING_MODEL_NAME, device)
+
+    for backend in ENCODER_BACKENDS:
+        try:
+            model = load_encoder(EMBEDDING_MODEL_NAME, device, backend)
+        except Exception as exc:
+            print(f"{backend:>6}: unavailable ({exc})")
+            continue
+
+        worst, mean = cosine_agreement(model, reference)
+        for q in queries[:4]:
+            encode_normalized(model, [q])
+
+        started = time.perf_counter()
+        for q in queries:
+            encode_normalized(model, [q])
+        per_query = (time.perf_counter() - started) / len(queries) * 1000
+
+        print(
+            f"{backend:>6}: {per_query:.2f} ms/query | "
+            f"cosine vs torch min {worst:.4f}, mean {mean:.4f}"
+        )
@@ -0,0 +1,312 @@
+import bisect
+import itertools
+import json
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+
+from src.search.embedding_store import replace_dir
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+FACETS_FORMAT_VERSION = 1
+FACET_ARRAYS = (
+    "row_ids",
+    "years",
+    "description_source",
+    "subjects_source",
+    "subject_indptr",
+    "subject_docs",
+)
+
+FILTER_KEYS = (
+    "year_min",
+    "year_max",
+    "subject",
+    "description_source",
+    "subjects_source",
+)
+
+# row tuple positions as returned by load_books_from_db
+YEAR_POS = 4
+SUBJECTS_POS = 7
+DESCRIPTION_SOURCE_POS = 8
+SUBJECTS_SOURCE_POS = 9
+
+YEAR_UNKNOWN = 0
+SOURCE_UNKNOWN = -1
+
+# rows matched per normalized subject filter, kept in an LRU bounded by
+# entry count and total bytes
+SUBJECT_CACHE_ENTRIES = int(os.environ.get("SUBJECT_CACHE_ENTRIES", "1024"))
+SUBJECT_CACHE_MAX_BYTES = int(os.environ.get("SUBJECT_CACHE_MAX_BYTES", str(64 << 20)))
+
+# joins the subject terms into one searchable string (never inside a term)
+SUBJECT_SEPARATOR = "\0"
+
+
+def clean_filters(filters):
+    # drops unset keys; None means "no filtering at all"
+    if not filters:
+        return None
+
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown search filters: {sorted(unknown)}")
+
+    cleaned = {k: v for k, v in filters.items() if v is not None and v != ""}
+    return cleaned or None
+
+
+def split_subjects(subjects):
+    if not subjects:
+        return []
+    return [s.strip().lower() for s in subjects.split(";") if s.strip()]
+
+
+def _parse_year(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return YEAR_UNKNOWN
+
+
+def _encode_categories(values):
+    categories = sorted({v for v in values if v})
+    lookup = {c: i for i, c in enumerate(categories)}
+    codes = np.array([lookup.get(v, SOURCE_UNKNOWN) for v in values], dtype=np.int16)
+    return codes, categories
+
+
+# -------------------------------
+# FACET INDEX
+# -------------------------------
+class FacetIndex:
+    # Per-row facet columns aligned to the embedding rows. Filters are turned
+    # into one boolean mask over those rows with vectorized comparisons;
+    # subjects are a small CSR of subject term -> rows.
+    def __init__(
+        self,
+        row_ids,
+        years,
+        description_source,
+        subjects_source,
+        subject_indptr,
+        subject_docs,
+        categories,
+        subjects,
+    ):
+        self.row_ids = row_ids
+        self.years = years
+        self.description_source = description_source
+        self.subjects_source = subjects_source
+        self.subject_indptr = subject_indptr
+        self.subject_docs = subject_docs
+        self.categories = categories
+        self.subjects = subjects
+
+        self._subject_text = None
+        self._subject_starts = None
+        self._subject_cache = OrderedDict()
+        self._subject_cache_bytes = 0
+        self._subject_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    @classmethod
+    def build(cls, rows, row_ids):
+        # rows are laid out in row_ids order; ids without a row get no facets
+        by_id = {r[0]: r for r in rows}
+        ordered = [by_id.get(int(rid)) for rid in row_ids]
+
+        def column(pos):
+            return [r[pos] if r is not None else None for r in ordered]
+
+        years = np.array([_parse_year(y) for y in column(YEAR_POS)], dtype=np.int16)
+        desc_codes, desc_categories = _encode_categories(column(DESCRIPTION_SOURCE_POS))
+        subj_codes, subj_categories = _encode_categories(column(SUBJECTS_SOURCE_POS))
+
+        postings = {}
+        for doc, subjects in enumerate(column(SUBJECTS_POS)):
+            for s in set(split_subjects(subjects)):
+                postings.setdefault(s, []).append(doc)
+
+        subjects = sorted(postings)
+        indptr = np.zeros(len(subjects) + 1, dtype=np.int64)
+        np.cumsum([len(postings[s]) for s in subjects], out=indptr[1:])
+        docs = np.array([d for s in subjects for d in postings[s]], dtype=np.int64)
+
+        return cls(
+            np.asarray(row_ids, dtype=np.int64),
+            years,
+            desc_codes,
+            subj_codes,
+            indptr,
+            docs,
+            {"description_source": desc_categories, "subjects_source": subj_categories},
+            subjects,
+        )
+
+    def subset(self, rows):
+        # facets of the given rows only, renumbered 0..len(rows)-1
+        rows = np.asarray(rows, dtype=np.int64)
+        remap = np.full(len(self), -1, dtype=np.int64)
+        remap[rows] = np.arange(len(rows))
+
+        terms = np.repeat(np.arange(len(self.subjects)), np.diff(self.subject_indptr))
+        docs = remap[self.subject_docs]
+        keep = docs >= 0
+
+        counts = np.bincount(terms[keep], minlength=len(self.subjects))
+        indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        return FacetIndex(
+            self.row_ids[rows],
+            self.years[rows],
+            self.description_source[rows],
+            self.subjects_source[rows],
+            indptr,
+            docs[keep],
+            self.categories,
+            self.subjects,
+        )
+
+    def mask(self, filters):
+        filters = clean_filters(filters)
+        if filters is None:
+            return None
+
+        mask = np.ones(len(self), dtype=bool)
+
+        year_min = filters.get("year_min")
+        year_max = filters.get("year_max")
+        if year_min is not None or year_max is not None:
+            mask &= self.years != YEAR_UNKNOWN
+            if year_min is not None:
+                mask &= self.years >= int(year_min)
+            if year_max is not None:
+                mask &= self.years <= int(year_max)
+
+        for facet in ("description_source", "subjects_source"):
+            value = filters.get(facet)
+            if value is None:
+                continue
+            categories = self.categories[facet]
+            if value not in categories:
+                return np.zeros(len(self), dtype=bool)
+            mask &= getattr(self, facet) == categories.index(value)
+
+        subject = filters.get("subject")
+        if subject is not None:
+            mask &= self.subject_mask(subject)
+
+        return mask
+
+    def subject_mask(self, text):
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.subject_rows(text)] = True
+        return mask
+
+    def subject_rows(self, text):
+        # rows with a subject term containing text, cached per normalized
+        # text, so a repeated filter costs one mask fill
+        key = text.strip().lower()
+        with self._subject_lock:
+            rows = self._subject_cache.get(key)
+            if rows is not None:
+                self._subject_cache.move_to_end(key)
+                return rows
+
+        rows = self._match_subject(key)
+        rows.setflags(write=False)
+
+        with self._subject_lock:
+            old = self._subject_cache.pop(key, None)
+            if old is not None:
+                self._subject_cache_bytes -= old.nbytes
+            self._subject_cache[key] = rows
+            self._subject_cache_bytes += rows.nbytes
+            while self._subject_cache and (
+                len(self._subject_cache) > SUBJECT_CACHE_ENTRIES
+                or self._subject_cache_bytes > SUBJECT_CACHE_MAX_BYTES
+            ):
+                _, evicted = self._subject_cache.popitem(last=False)
+                self._subject_cache_bytes -= evicted.nbytes
+        return rows
+
+    def _match_subject(self, text):
+        # Substring match over all terms joined into one string: str.find
+        # jumps from match to match, so the cost follows the matching terms,
+        # not the size of the subject vocabulary.
+        if self._subject_text is None:
+            lengths = (len(s) + 1 for s in self.subjects)
+            self._subject_starts = list(itertools.accumulate(lengths, initial=0))
+            self._subject_text = SUBJECT_SEPARATOR.join(self.subjects)
+
+        terms = []
+        if not text:
+            terms = range(len(self.subjects))
+        elif SUBJECT_SEPARATOR not in text:
+            starts, haystack = self._subject_starts, self._subject_text
+            pos = haystack.find(text)
+            while pos >= 0:
+                t = bisect.bisect_right(starts, pos) - 1
+                terms.append(t)
+                pos = haystack.find(text, starts[t + 1])
+
+        # CSR gather of the matched terms' postings
+        terms = np.asarray(terms, dtype=np.int64)
+        first = self.subject_indptr[terms]
+        counts = self.subject_indptr[terms + 1] - first
+        offsets = np.repeat(first - np.cumsum(counts) + counts, counts)
+        offsets += np.arange(len(offsets))
+        return np.unique(self.subject_docs[offsets])
+
+
+# -------------------------------
+# PERSISTENCE
+# -------------------------------
+def save_facet_index(index, index_dir, source=None):
+    index_dir = Path(index_dir)
+    tmp_dir = index_dir.with_name(f"{index_dir.name}.tmp-{os.getpid()}")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    for name in FACET_ARRAYS:
+        np.save(tmp_dir / f"{name}.npy", getattr(index, name))
+
+    header = {
+        "format_version": FACETS_FORMAT_VERSION,
+        "n_rows": len(index),
+        "categories": index.categories,
+        "subjects": index.subjects,
+        "source": source or {},
+    }
+    (tmp_dir / "header.json").write_text(json.dumps(header))
+
+    replace_dir(tmp_dir, index_dir)
+
+
+def load_facet_index(index_dir, source=None, mmap=False):
+    index_dir = Path(index_dir)
+    header_file = index_dir / "header.json"
+    if not header_file.exists():
+        return None
+
+    header = json.loads(header_file.read_text())
+    if header.get("format_version") != FACETS_FORMAT_VERSION:
+        return None
+    if source is not None and header.get("source") != source:
+        return None
+
+    mmap_mode = "r" if mmap else None
+    arrays = {
+        name: np.load(index_dir / f"{name}.npy", mmap_mode=mmap_mode)
+        for name in FACET_ARRAYS
+    }
+    return FacetIndex(
+        **arrays, categories=header["categories"], subjects=header["subjects"]
+    )
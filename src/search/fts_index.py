@@ -0,0 +1,127 @@
+import re
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+FTS_TABLE = "books_fts"
+FTS_COLUMNS = ("title", "author", "subjects", "description")
+
+# point lookups by ISBN (/search/isbn)
+ISBN_INDEX = "idx_books_isbn"
+
+# bm25() weight per column, in FTS_COLUMNS order: a title hit outranks the
+# same term buried in a description
+FTS_WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+
+# External-content FTS5 table over books: the text lives only in books, the
+# index is kept in sync by triggers. prefix='2 3' adds prefix indexes so
+# "pot*" does not scan every term.
+FTS_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        {", ".join(FTS_COLUMNS)},
+        content='books',
+        content_rowid='row_id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON books BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {", ".join(FTS_COLUMNS)})
+        VALUES (new.row_id, {", ".join(f"new.{c}" for c in FTS_COLUMNS)});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON books BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {", ".join(FTS_COLUMNS)})
+        VALUES ('delete', old.row_id, {", ".join(f"old.{c}" for c in FTS_COLUMNS)});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF {", ".join(FTS_COLUMNS)} ON books BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {", ".join(FTS_COLUMNS)})
+        VALUES ('delete', old.row_id, {", ".join(f"old.{c}" for c in FTS_COLUMNS)});
+        INSERT INTO {FTS_TABLE}(rowid, {", ".join(FTS_COLUMNS)})
+        VALUES (new.row_id, {", ".join(f"new.{c}" for c in FTS_COLUMNS)});
+    END
+    """,
+]
+
+
+# -------------------------------
+# SCHEMA
+# -------------------------------
+def schema_exists(conn, kind, name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type=? AND name=?", (kind, name)
+    ).fetchone()
+    return row is not None
+
+
+def fts_exists(conn):
+    return schema_exists(conn, "table", FTS_TABLE)
+
+
+def isbn_index_exists(conn):
+    return schema_exists(conn, "index", ISBN_INDEX)
+
+
+def create_fts(conn):
+    # returns True if the table was just created and still has to be filled
+    # from the existing rows with rebuild_fts
+    created = not fts_exists(conn)
+    for statement in FTS_SCHEMA:
+        conn.execute(statement)
+    return created
+
+
+def rebuild_fts(conn):
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def migrate_search_schema(conn):
+    # Adds the FTS table (indexed from the existing rows) and the ISBN index
+    # to a DB created before they existed. Writes nothing when both are
+    # present, so the DB signature of an up-to-date DB does not change.
+    if fts_exists(conn) and isbn_index_exists(conn):
+        return False
+
+    if create_fts(conn):
+        print("[INFO] FTS index missing. Building it from the books table...")
+        rebuild_fts(conn)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {ISBN_INDEX} ON books(isbn)")
+    conn.commit()
+    return True
+
+
+def optimize_fts(conn):
+    # merges the index segments written by many small inserts
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+# -------------------------------
+# QUERIES
+# -------------------------------
+def fts_match(text, column=None):
+    # User text -> FTS5 MATCH expression. Every word is quoted, so FTS
+    # operators and punctuation are literal, words are ANDed and the last
+    # one matches as a prefix ("harry pot" finds "Harry Potter"). Returns
+    # None when the text has no words.
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+
+    phrases = [f'"{w}"' for w in words]
+    phrases[-1] += "*"
+    expr = " ".join(phrases)
+
+    if column is not None:
+        expr = f"{column} : ({expr})"
+    return expr
+
+
+def fts_order():
+    weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+    return f"bm25({FTS_TABLE}, {weights})"
@@ -0,0 +1,175 @@
+import json
+import os
+import numpy as np
+from pathlib import Path
+
+from src.search.embedding_store import replace_dir
+from src.search.sqlite_pool import SqlitePool
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+# bump when the on-disk layout changes; older artifacts are rebuilt
+METADATA_FORMAT_VERSION = 1
+
+# result fields and their position in the rows returned by load_books_from_db
+RESULT_FIELDS = {
+    "isbn": 1,
+    "title": 2,
+    "author": 3,
+    "year": 4,
+    "publisher": 5,
+    "description": 6,
+    "subjects": 7,
+}
+
+
+# -------------------------------
+# COLUMNAR STORE
+# -------------------------------
+class TextColumn:
+    # value i is buffer[offsets[i]:offsets[i + 1]] decoded as UTF-8,
+    # or None where nulls[i] is set
+    def __init__(self, offsets, buffer, nulls):
+        self.offsets = offsets
+        self.buffer = buffer
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def __getitem__(self, i):
+        if self.nulls[i]:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return bytes(self.buffer[start:end]).decode("utf-8")
+
+    @classmethod
+    def from_values(cls, values):
+        nulls = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+        encoded = [b"" if v is None else str(v).encode("utf-8") for v in values]
+
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        return cls(offsets, buffer, nulls)
+
+
+class ColumnarMetadata:
+    # one UTF-8 buffer + offsets per text column; nothing is decoded into
+    # Python objects until a result row is actually formatted
+    def __init__(self, row_ids, columns):
+        self.row_ids = row_ids
+        self.columns = columns
+        self._order = np.argsort(row_ids, kind="stable")
+        self._sorted_ids = row_ids[self._order]
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    @classmethod
+    def from_rows(cls, rows):
+        row_ids = np.array([r[0] for r in rows], dtype=np.int64)
+        columns = {
+            name: TextColumn.from_values([r[pos] for r in rows])
+            for name, pos in RESULT_FIELDS.items()
+        }
+        return cls(row_ids, columns)
+
+    def positions(self, row_ids):
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        idx = np.searchsorted(self._sorted_ids, row_ids)
+        idx = np.clip(idx, 0, max(len(self._sorted_ids) - 1, 0))
+
+        found = self._sorted_ids[idx] == row_ids
+        return np.where(found, self._order[idx], -1)
+
+    def record(self, pos):
+        return {name: col[pos] for name, col in self.columns.items()}
+
+    def get_many(self, row_ids):
+        return [
+            self.record(pos) if pos >= 0 else None
+            for pos in self.positions(row_ids)
+        ]
+
+    # ---- persistence ----
+    def save(self, store_dir, source=None):
+        store_dir = Path(store_dir)
+        tmp_dir = store_dir.with_name(f"{store_dir.name}.tmp-{os.getpid()}")
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+
+        np.save(tmp_dir / "row_ids.npy", self.row_ids)
+        for name, col in self.columns.items():
+            np.save(tmp_dir / f"{name}.offsets.npy", col.offsets)
+            np.save(tmp_dir / f"{name}.buffer.npy", col.buffer)
+            np.save(tmp_dir / f"{name}.nulls.npy", col.nulls)
+
+        header = {
+            "format_version": METADATA_FORMAT_VERSION,
+            "n_rows": len(self),
+            "columns": list(self.columns),
+            "source": source or {},
+        }
+        (tmp_dir / "header.json").write_text(json.dumps(header, indent=2))
+
+        replace_dir(tmp_dir, store_dir)
+
+    @classmethod
+    def load(cls, store_dir, source=None, mmap=True):
+        store_dir = Path(store_dir)
+        header_file = store_dir / "header.json"
+        if not header_file.exists():
+            return None
+
+        header = json.loads(header_file.read_text())
+        if header.get("format_version") != METADATA_FORMAT_VERSION:
+            return None
+        if source is not None and header.get("source") != source:
+            return None
+
+        mmap_mode = "r" if mmap else None
+
+        def load(name):
+            return np.load(store_dir / f"{name}.npy", mmap_mode=mmap_mode)
+
+        columns = {
+            name: TextColumn(
+                load(f"{name}.offsets"), load(f"{name}.buffer"), load(f"{name}.nulls")
+            )
+            for name in header["columns"]
+        }
+        return cls(np.asarray(load("row_ids")), columns)
+
+
+# -------------------------------
+# SQLITE LOOKUP
+# -------------------------------
+class SqliteMetadata:
+    # nothing resident: only the top-k rows of each result are read from the DB
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.pool = SqlitePool(db_path)
+
+    def get_many(self, row_ids):
+        row_ids = [int(r) for r in row_ids]
+        if not row_ids:
+            return []
+
+        conn = self.pool.connection()
+        placeholders = ",".join("?" * len(row_ids))
+        rows = conn.execute(
+            f"""
+            SELECT row_id, {", ".join(RESULT_FIELDS)}
+            FROM books
+            WHERE row_id IN ({placeholders})
+            """,
+            row_ids,
+        ).fetchall()
+
+        by_id = {r["row_id"]: {field: r[field] for field in RESULT_FIELDS} for r in rows}
+        return [by_id.get(rid) for rid in row_ids]
+
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,19 @@
+import sqlite3
+
+from src.config import DB_PATH
+from src.search.fts_index import migrate_search_schema
+from src.search.semantic_search import artifact_lock, prepare_search_artifacts
+
+# Builds or refreshes every search artifact once, e.g. before
+#   uvicorn src.api.main:app --workers 8
+# so workers only attach to the prepared files. Older DBs get the FTS / ISBN
+# indexes first, under the artifact lock and before the DB signature is
+# taken; API workers never write to the DB.
+if __name__ == "__main__":
+    with artifact_lock():
+        conn = sqlite3.connect(str(DB_PATH))
+        migrate_search_schema(conn)
+        conn.close()
+
+        state = prepare_search_artifacts()
+    print(f"[INFO] Search artifacts ready (index version {state['version']})")
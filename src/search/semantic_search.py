@@ -1,11 +1,53 @@
+import hashlib
+import json
+import os
 import sqlite3
+import threading
+import time
 import numpy as np
+from contextlib import contextmanager
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-from rank_bm25 import BM25Okapi
-import torch
+
+try:
+    import fcntl
+except ImportError:  # Windows: artifact builds are not serialized
+    fcntl = None
 
 from src.config import DB_PATH
+from src.search.ann_index import ExactIndex, load_dense_index, top_k_desc
+from src.search.batching import MicroBatcher
+from src.search.bm25_index import (
+    InvertedBM25,
+    load_bm25_index,
+    read_bm25_header,
+    save_bm25_index,
+    tokenize,
+)
+from src.search.cache import QueryEmbeddingCache, ResultCache
+from src.search.embedding_builder import (
+    build_embeddings,
+    clear_build,
+    default_workers,
+)
+from src.search.embedding_store import (
+    as_embedding_store,
+    load_embedding_store,
+    store_paths,
+)
+from src.search.encoder import load_validated_encoder
+from src.search.facets import (
+    FacetIndex,
+    clean_filters,
+    load_facet_index,
+    save_facet_index,
+)
+from src.search.metadata_store import ColumnarMetadata, SqliteMetadata
+from src.search.sharding import ShardedSearch
+from src.search.similarity_graph import (
+    SimilarityGraph,
+    build_similarity_graph,
+    similarity_graph_state,
+)
 
 # -------------------------------
 # CONFIG
@@ -13,36 +55,171 @@ from src.config import DB_PATH
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 EMBEDDINGS_FILE = Path("book_embeddings.npy")
 ROW_IDS_FILE = Path("book_row_ids.npy")
+ROW_HASHES_FILE = Path("book_row_hashes.npy")
+EMBEDDING_MANIFEST_FILE = Path("book_embeddings.manifest.json")
+EMBEDDING_MANIFEST_VERSION = 3
+
+# offline embedding builds: worker processes (1 = in-process), torch threads
+# per worker and rows per checkpointed chunk
+EMBEDDING_TORCH_THREADS = int(os.environ.get("EMBEDDING_TORCH_THREADS", "2"))
+EMBEDDING_WORKERS = int(
+    os.environ.get("EMBEDDING_WORKERS", default_workers(EMBEDDING_TORCH_THREADS))
+)
+EMBEDDING_CHUNK_SIZE = int(os.environ.get("EMBEDDING_CHUNK_SIZE", "2048"))
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+
+# per-field token budget applied before encoding (JSON override via env);
+# MiniLM truncates at 256 tokens anyway, so overflow only costs compute
+FIELD_TOKEN_BUDGET = json.loads(
+    os.environ.get(
+        "FIELD_TOKEN_BUDGET",
+        '{"title": 32, "description": 160, "subjects": 48, "author": 16}',
+    )
+)
+BM25_INDEX_DIR = Path("book_bm25.idx")
+METADATA_DIR = Path("book_metadata.idx")
+FACETS_DIR = Path("book_facets.idx")
+
+# serializes artifact builds across processes (e.g. uvicorn workers) and
+# records the index version the artifacts were last prepared for
+ARTIFACT_LOCK_FILE = Path("book_search.lock")
+ARTIFACT_READY_FILE = Path("book_search.ready.json")
+
+# where result fields come from: "columnar" (mmapped UTF-8 columns) or
+# "sqlite" (top-k rows fetched by row_id per query, nothing resident)
+METADATA_STORE = os.environ.get("METADATA_STORE", "columnar")
+
+# on-disk layout served to the engine: float32, float16 or int8 (per-row scaled)
+EMBEDDING_STORE_DTYPE = os.environ.get("EMBEDDING_STORE_DTYPE", "float32")
+EMBEDDING_STORE_MMAP = os.environ.get("EMBEDDING_STORE_MMAP", "1") == "1"
+
+# dense index behind embedding_only_search: "exact" (full scan), "ivf",
+# "binary" (sign-bit Hamming scan) or "reduced" (PCA / Matryoshka prefix of
+# REDUCED_DIM dims). binary and reduced rescore top_k * <kind>_RESCORE rows at
+# full precision (REDUCED_RESCORE=0 ranks in the reduced space only)
+DENSE_INDEX = os.environ.get("DENSE_INDEX", "exact")
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "8"))
+BINARY_RESCORE = int(os.environ.get("BINARY_RESCORE", "10"))
+REDUCED_DIM = int(os.environ.get("REDUCED_DIM", "128"))
+REDUCED_METHOD = os.environ.get("REDUCED_METHOD", "pca")
+REDUCED_RESCORE = int(os.environ.get("REDUCED_RESCORE", "10"))
 
 TOP_K = 5
 BM25_CANDIDATES = 200
 
+# fused hybrid mode: dense + BM25 over every eligible row.
+# "weighted": FUSION_ALPHA * dense + (1 - FUSION_ALPHA) * BM25, both min-max
+# normalized per query; "rrf": reciprocal-rank fusion of each list's top
+# RRF_DEPTH rows with constant RRF_K
+FUSION_METHOD = os.environ.get("FUSION_METHOD", "weighted")
+FUSION_ALPHA = float(os.environ.get("FUSION_ALPHA", "0.7"))
+RRF_K = int(os.environ.get("RRF_K", "60"))
+RRF_DEPTH = int(os.environ.get("RRF_DEPTH", "1000"))
+QUERY_BATCH_SIZE = 64
+
+# LRU of normalized query -> embedding (0 entries disables, 0 bytes = no byte cap)
+QUERY_CACHE_ENTRIES = int(os.environ.get("QUERY_CACHE_ENTRIES", "4096"))
+QUERY_CACHE_MAX_BYTES = int(os.environ.get("QUERY_CACHE_MAX_BYTES", "0"))
+
+# final result lists keyed on (query, mode, top_k, params, index version);
+# RESULT_CACHE_FILE (optional) persists them across restarts
+RESULT_CACHE_ENTRIES = int(os.environ.get("RESULT_CACHE_ENTRIES", "10000"))
+RESULT_CACHE_FILE = os.environ.get("RESULT_CACHE_FILE") or None
+
+# encoder used for queries and embedding builds: "torch", "int8" or "onnx"
+# (see src/search/encoder.py). Non-torch backends are validated at load
+# unless ENCODER_VALIDATE=0.
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "torch")
+ENCODER_VALIDATE = os.environ.get("ENCODER_VALIDATE", "1") == "1"
+
+# catalog rows re-encoded by that check and compared with their stored
+# embeddings (the torch model is only the reference before any build exists)
+ENCODER_VALIDATION_ROWS = int(os.environ.get("ENCODER_VALIDATION_ROWS", "64"))
+
+# page stride used when pre-faulting mmapped artifacts during warm-up, and
+# the ";"-separated queries run through every search path before serving
+WARM_UP_PAGE_BYTES = 4096
+WARM_UP_QUERIES = [
+    q.strip()
+    for q in os.environ.get(
+        "WARM_UP_QUERIES", "science fiction;history of rome;learning python"
+    ).split(";")
+    if q.strip()
+]
+
+
+# -------------------------------
+# ARTIFACT LOCK
+# -------------------------------
+# Every writer of a shared artifact (embeddings and their build scratch
+# files, BM25, metadata, facets, dense indexes) holds this lock, so builders
+# in other processes (API workers, the UI, prepare_index) never interleave.
+# flock serializes processes; within a process the lock is reentrant, as
+# prepare calls the load_or_build_* helpers that take it again.
+_artifact_thread_lock = threading.RLock()
+_artifact_lock_depth = 0
+
+
+@contextmanager
+def artifact_lock():
+    global _artifact_lock_depth
+    with _artifact_thread_lock:
+        if _artifact_lock_depth:
+            _artifact_lock_depth += 1
+            try:
+                yield
+            finally:
+                _artifact_lock_depth -= 1
+            return
+
+        with open(ARTIFACT_LOCK_FILE, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            _artifact_lock_depth = 1
+            try:
+                yield
+            finally:
+                _artifact_lock_depth = 0
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
 
 # -------------------------------
 # DB LOAD
 # -------------------------------
-def load_books_from_db():
+BOOK_ROW_COLUMNS = (
+    "row_id",
+    "isbn",
+    "title",
+    "author",
+    "year",
+    "publisher",
+    "description",
+    "subjects",
+    "description_source",
+    "subjects_source",
+)
+
+
+def connect_db_readonly():
     if not DB_PATH.exists():
         raise FileNotFoundError(f"Database not found at {DB_PATH}")
 
-    conn = sqlite3.connect(str(DB_PATH))
+    # read-only: closing a read-write connection may checkpoint the WAL into
+    # books.db, and processes that only prepare artifacts never write to it
+    return sqlite3.connect(f"{DB_PATH.resolve().as_uri()}?mode=ro", uri=True)
+
+
+def load_books_from_db():
+    conn = connect_db_readonly()
     cur = conn.cursor()
 
     cur.execute(
+        f"""
+        SELECT {", ".join(BOOK_ROW_COLUMNS)}
+        FROM books
+        WHERE description IS NOT NULL
         """
-       SELECT
-    row_id,
-    isbn,
-    title,
-    author,
-    year,
-    publisher,
-    description,
-    subjects
-FROM books
-WHERE description IS NOT NULL
-
-    """
     )
 
     rows = cur.fetchall()
@@ -54,173 +231,1067 @@ WHERE description IS NOT NULL
     return rows
 
 
+def load_books_by_id(row_ids, batch=500):
+    # same row layout as load_books_from_db, for the given row_ids only
+    conn = connect_db_readonly()
+    rows = []
+    row_ids = [int(r) for r in row_ids]
+    for start in range(0, len(row_ids), batch):
+        part = row_ids[start : start + batch]
+        rows += conn.execute(
+            f"""
+            SELECT {", ".join(BOOK_ROW_COLUMNS)}
+            FROM books
+            WHERE row_id IN ({", ".join("?" * len(part))})
+              AND description IS NOT NULL
+            """,
+            part,
+        ).fetchall()
+    conn.close()
+    return rows
+
+
 # -------------------------------
 # EMBEDDING GENERATION
 # -------------------------------
+def search_fields(row):
+    _, _, title, author, _, _, description, subjects = row[:8]
+
+    return {
+        "title": title,
+        "description": description,
+        "subjects": subjects,
+        "author": author,
+    }
+
+
 def build_search_text(row):
-    _, _, title, author, _, _, description, subjects = row
+    return " ".join(text for text in search_fields(row).values() if text)
 
-    parts = []
-    if title:
-        parts.append(title)
-    if description:
-        parts.append(description)
-    if subjects:
-        parts.append(subjects)
-    if author:
-        parts.append(author)
 
-    return " ".join(parts)
+# torch / transformers are imported on first use: importing this module (and
+# the API) stays cheap, and processes that only attach to artifacts or serve
+# lexical queries never pay for them
+def default_device():
+    import torch
 
+    return "cuda" if torch.cuda.is_available() else "cpu"
 
-def generate_embeddings(rows):
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device)
 
-    texts = [build_search_text(r) for r in rows]
-    row_ids = np.array([r[0] for r in rows], dtype=np.int64)
+def load_query_model():
+    model, backend = load_validated_encoder(
+        EMBEDDING_MODEL_NAME,
+        default_device(),
+        ENCODER_BACKEND,
+        ENCODER_VALIDATE,
+        reference=stored_encoder_reference(),
+    )
+    print(f"[INFO] Query encoder backend: {backend}")
+    return model
+
+
+def validates_encoder():
+    return ENCODER_BACKEND != "torch" and ENCODER_VALIDATE
+
+
+def sample_positions(n):
+    # up to ENCODER_VALIDATION_ROWS positions spread evenly over n rows
+    k = min(ENCODER_VALIDATION_ROWS, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.linspace(0, n - 1, k).astype(np.int64))
+
+
+def encoder_reference(rows, embeddings):
+    # (texts, stored embeddings) the backend must reproduce, or None
+    if not len(rows):
+        return None
+    texts = budgeted_search_texts(rows, load_tokenizer())
+    return texts, np.asarray(embeddings, dtype=np.float32)
+
+
+def stored_encoder_reference():
+    # a sample of the served embeddings whose rows are unchanged in the DB
+    # (same content hash), for validating the query encoder
+    files = (EMBEDDINGS_FILE, ROW_IDS_FILE, ROW_HASHES_FILE)
+    if not validates_encoder() or not all(f.exists() for f in files):
+        return None
+
+    row_ids = np.load(ROW_IDS_FILE)
+    hashes = np.load(ROW_HASHES_FILE)
+    embeddings = np.load(EMBEDDINGS_FILE, mmap_mode="r")
+    if not len(row_ids) == len(hashes) == len(embeddings):
+        return None
+
+    pos = sample_positions(len(row_ids))
+    by_id = {r[0]: r for r in load_books_by_id(row_ids[pos])}
+    pos = np.array([p for p in pos if int(row_ids[p]) in by_id], dtype=np.int64)
+    rows = [by_id[int(row_ids[p])] for p in pos]
+    same = np.flatnonzero(row_content_hashes(rows) == hashes[pos])
+
+    return encoder_reference([rows[i] for i in same], embeddings[pos[same]])
 
-    embeddings = model.encode(
+
+def load_tokenizer():
+    from transformers import AutoTokenizer
+
+    model_id = f"sentence-transformers/{EMBEDDING_MODEL_NAME}"
+    return AutoTokenizer.from_pretrained(model_id)
+
+
+def budgeted_search_texts(rows, tokenizer, budget=None):
+    # same text as build_search_text, with each field cut to its token budget
+    # at a token boundary of the original string
+    budget = budget or FIELD_TOKEN_BUDGET
+    fields = [search_fields(r) for r in rows]
+
+    for name, max_tokens in budget.items():
+        idx = [i for i, f in enumerate(fields) if f.get(name)]
+        if not idx:
+            continue
+
+        enc = tokenizer(
+            [fields[i][name] for i in idx],
+            add_special_tokens=False,
+            truncation=True,
+            max_length=max_tokens,
+            return_offsets_mapping=True,
+        )
+        for i, offsets in zip(idx, enc["offset_mapping"]):
+            if len(offsets) >= max_tokens:
+                fields[i][name] = fields[i][name][: offsets[-1][1]]
+
+    return [" ".join(text for text in f.values() if text) for f in fields]
+
+
+def encode_bucketed(model, texts, batch_size=64):
+    # encode in order of tokenized length so each batch pads to similar
+    # lengths, then restore the caller's order
+    lengths = np.array(
+        [
+            len(ids)
+            for ids in model.tokenizer(
+                list(texts),
+                truncation=True,
+                max_length=model.max_seq_length,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+            )["input_ids"]
+        ],
+        dtype=np.int64,
+    )
+    order = np.argsort(lengths, kind="stable")
+
+    dim = model.get_sentence_embedding_dimension()
+    embeddings = np.empty((len(texts), dim), dtype=np.float32)
+
+    for start in range(0, len(texts), batch_size):
+        part = order[start : start + batch_size]
+        embeddings[part] = model.encode(
+            [texts[i] for i in part],
+            batch_size=len(part),
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+
+    return embeddings, int(lengths.sum())
+
+
+def row_content_hashes(rows):
+    # one 64-bit digest per row over the model name, token budget and search
+    # text, so content edits and encoder changes both mark the row as changed
+    hashes = np.empty(len(rows), dtype=np.uint64)
+    budget = json.dumps(FIELD_TOKEN_BUDGET, sort_keys=True)
+    prefix = f"{EMBEDDING_MODEL_NAME}\0{budget}\0".encode("utf-8")
+
+    for i, r in enumerate(rows):
+        digest = hashlib.blake2b(
+            prefix + build_search_text(r).encode("utf-8"), digest_size=8
+        )
+        hashes[i] = int.from_bytes(digest.digest(), "little")
+
+    return hashes
+
+
+def encode_texts(texts, out_file=EMBEDDINGS_FILE, reference=None):
+    # chunked, resumable build into a memmap next to out_file; CPU builds are
+    # sharded across EMBEDDING_WORKERS processes. A non-torch backend is
+    # validated once here (against reference, see encoder_reference); workers
+    # only get the resolved backend, and a single in-process worker reuses
+    # the validated model.
+    device = default_device()
+    workers = EMBEDDING_WORKERS if device == "cpu" else 1
+
+    backend = ENCODER_BACKEND
+    model = None
+    if validates_encoder():
+        model, backend = load_validated_encoder(
+            EMBEDDING_MODEL_NAME, device, backend, reference=reference
+        )
+        if workers > 1:
+            model = None
+
+    matrix_file = build_embeddings(
         texts,
-        batch_size=64,
-        show_progress_bar=True,
-        convert_to_numpy=True,
-        normalize_embeddings=True,
+        out_file,
+        EMBEDDING_MODEL_NAME,
+        workers=workers,
+        torch_threads=EMBEDDING_TORCH_THREADS,
+        chunk_size=EMBEDDING_CHUNK_SIZE,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        device=device,
+        encode_fn=encode_bucketed,
+        backend=backend,
+        model=model,
     )
+    return np.load(matrix_file, mmap_mode="r")
+
+
+def match_unchanged_rows(old_row_ids, old_hashes, row_ids, hashes):
+    # position of each row in the previous build, or -1 if new/changed
+    if len(old_row_ids) == 0:
+        return np.full(len(row_ids), -1, dtype=np.int64)
+
+    order = np.argsort(old_row_ids)
+    sorted_ids = old_row_ids[order]
+    pos = np.clip(np.searchsorted(sorted_ids, row_ids), 0, len(sorted_ids) - 1)
+
+    old_idx = order[pos]
+    same = (sorted_ids[pos] == row_ids) & (old_hashes[old_idx] == hashes)
+    return np.where(same, old_idx, -1).astype(np.int64)
+
+
+def generate_embeddings(rows, previous=None):
+    row_ids = np.array([r[0] for r in rows], dtype=np.int64)
+    hashes = row_content_hashes(rows)
+
+    reuse = np.full(len(rows), -1, dtype=np.int64)
+    old_embeddings = None
+    if previous is not None:
+        old_embeddings, old_row_ids, old_hashes = previous
+        reuse = match_unchanged_rows(old_row_ids, old_hashes, row_ids, hashes)
+        dropped = len(np.setdiff1d(old_row_ids, row_ids))
+        print(
+            f"[INFO] Incremental embedding update: {int((reuse < 0).sum())} of "
+            f"{len(rows)} rows new or changed, {dropped} dropped"
+        )
+
+    changed = np.flatnonzero(reuse < 0)
+    kept = np.flatnonzero(reuse >= 0)
+
+    fresh = None
+    if len(changed):
+        texts = budgeted_search_texts([rows[i] for i in changed], load_tokenizer())
+        # unchanged rows keep their stored vectors, so the encoder has to
+        # reproduce them
+        reference = None
+        if validates_encoder() and len(kept):
+            sample = kept[sample_positions(len(kept))]
+            reference = encoder_reference(
+                [rows[i] for i in sample], old_embeddings[reuse[sample]]
+            )
+        fresh = encode_texts(texts, reference=reference)
+    dim = fresh.shape[1] if fresh is not None else old_embeddings.shape[1]
+
+    # assemble on disk in chunks so the full matrix is never held in RAM
+    tmp = EMBEDDINGS_FILE.with_name(f"{EMBEDDINGS_FILE.stem}.assemble.npy")
+    embeddings = np.lib.format.open_memmap(
+        tmp, mode="w+", dtype=np.float32, shape=(len(rows), dim)
+    )
+    for start in range(0, len(kept), EMBEDDING_CHUNK_SIZE):
+        part = kept[start : start + EMBEDDING_CHUNK_SIZE]
+        embeddings[part] = old_embeddings[reuse[part]]
+    for start in range(0, len(changed), EMBEDDING_CHUNK_SIZE):
+        part = changed[start : start + EMBEDDING_CHUNK_SIZE]
+        embeddings[part] = fresh[start : start + EMBEDDING_CHUNK_SIZE]
 
     assert len(embeddings) == len(row_ids), "Embedding/ID alignment broken"
 
-    np.save(EMBEDDINGS_FILE, embeddings)
-    np.save(ROW_IDS_FILE, row_ids)
+    embeddings.flush()
+    del embeddings, fresh
+
+    # Every file is staged next to its target and its digest recorded as the
+    # pending build before any of them is swapped in, so after a crash each
+    # file on disk is known to belong to the previous or the pending build.
+    staged = {
+        EMBEDDINGS_FILE: tmp,
+        ROW_IDS_FILE: stage_array(ROW_IDS_FILE, row_ids),
+        ROW_HASHES_FILE: stage_array(ROW_HASHES_FILE, hashes),
+    }
+    build = {str(path): file_digest(tmp_file) for path, tmp_file in staged.items()}
+    save_embedding_manifest({**read_embedding_manifest(), "pending": build})
+
+    for path, tmp_file in staged.items():
+        os.replace(tmp_file, path)
+    clear_build(EMBEDDINGS_FILE)
+
+    save_embedding_manifest(
+        {
+            "model": EMBEDDING_MODEL_NAME,
+            "n_rows": len(row_ids),
+            "dim": int(dim),
+            "files": build,
+        }
+    )
 
+    embeddings = load_embedding_store(
+        EMBEDDINGS_FILE,
+        EMBEDDING_STORE_DTYPE,
+        mmap=EMBEDDING_STORE_MMAP,
+    )
     return embeddings, row_ids
 
 
+# -------------------------------
+# EMBEDDING MANIFEST
+# -------------------------------
+def stage_array(path, array):
+    tmp = path.with_name(f"{path.stem}.tmp-{os.getpid()}.npy")
+    np.save(tmp, array)
+    return tmp
+
+
+def file_digest(path):
+    # content fingerprint: unlike size/mtime it survives copies, checkouts
+    # and touch
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def embedding_file_digests():
+    return {
+        str(f): file_digest(f) for f in (EMBEDDINGS_FILE, ROW_IDS_FILE, ROW_HASHES_FILE)
+    }
+
+
+def read_embedding_manifest():
+    if not EMBEDDING_MANIFEST_FILE.exists():
+        return {}
+    manifest = json.loads(EMBEDDING_MANIFEST_FILE.read_text())
+    if manifest.get("format_version") != EMBEDDING_MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def save_embedding_manifest(manifest):
+    manifest = {"format_version": EMBEDDING_MANIFEST_VERSION, **manifest}
+    tmp = EMBEDDING_MANIFEST_FILE.with_name(
+        f"{EMBEDDING_MANIFEST_FILE.name}.tmp-{os.getpid()}"
+    )
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, EMBEDDING_MANIFEST_FILE)
+
+
+def load_embedding_manifest():
+    # (verified, row_ids, hashes) of the stored build, or None if it cannot be
+    # reused at all. verified: every file is byte-identical to a recorded
+    # build. Otherwise rows are only reused where their content hash still
+    # matches, which is safe as long as the matrix and the hashes line up.
+    files = (EMBEDDINGS_FILE, ROW_IDS_FILE, ROW_HASHES_FILE)
+    if not all(f.exists() for f in files):
+        return None
+
+    manifest = read_embedding_manifest()
+    builds = [b for b in (manifest.get("files"), manifest.get("pending")) if b]
+    digests = embedding_file_digests()
+    verified = digests in builds
+
+    if not verified:
+        pair = {str(EMBEDDINGS_FILE), str(ROW_HASHES_FILE)}
+        matched = [{f for f in pair if b.get(f) == digests[f]} for b in builds]
+        # an interrupted swap: the matrix and the hashes of different builds
+        if any(matched) and pair not in matched:
+            print("[WARN] Embedding matrix and row hashes are from different builds.")
+            return None
+        print("[WARN] Embedding files are not in their manifest. Reusing by hash.")
+
+    row_ids = np.load(ROW_IDS_FILE)
+    hashes = np.load(ROW_HASHES_FILE)
+    n_embeddings = len(np.load(EMBEDDINGS_FILE, mmap_mode="r"))
+    if not len(row_ids) == len(hashes) == n_embeddings:
+        print("[WARN] Saved embeddings, row_ids and hashes length mismatch.")
+        return None
+
+    return verified, row_ids, hashes
+
+
 # -------------------------------
 # LOAD OR BUILD EMBEDDINGS
 # -------------------------------
 def load_or_build_embeddings(rows):
-    if EMBEDDINGS_FILE.exists() and ROW_IDS_FILE.exists():
-        embeddings = np.load(EMBEDDINGS_FILE)
-        row_ids = np.load(ROW_IDS_FILE)
+    with artifact_lock():
+        saved = load_embedding_manifest()
+
+        if saved is None:
+            if EMBEDDINGS_FILE.exists():
+                print("[WARN] Saved embeddings cannot be reused. Regenerating...")
+            else:
+                print("[INFO] Embeddings not found. Regenerating from DB...")
+            return generate_embeddings(rows)
 
-        if len(embeddings) != len(row_ids):
-            raise RuntimeError("Saved embeddings and row_ids length mismatch")
+        verified, saved_row_ids, saved_hashes = saved
+        row_ids = np.array([r[0] for r in rows], dtype=np.int64)
+        hashes = row_content_hashes(rows)
 
-        return embeddings, row_ids
+        if (
+            verified
+            and np.array_equal(saved_row_ids, row_ids)
+            and np.array_equal(saved_hashes, hashes)
+        ):
+            embeddings = load_embedding_store(
+                EMBEDDINGS_FILE,
+                EMBEDDING_STORE_DTYPE,
+                mmap=EMBEDDING_STORE_MMAP,
+            )
+            return embeddings, saved_row_ids
 
-    print("[INFO] Embeddings not found. Regenerating from DB...")
-    return generate_embeddings(rows)
+        previous_embeddings = np.load(EMBEDDINGS_FILE, mmap_mode="r")
+        previous = previous_embeddings, saved_row_ids, saved_hashes
+        return generate_embeddings(rows, previous=previous)
 
 
 # -------------------------------
 # BM25 INDEX
 # -------------------------------
 def build_bm25_index(rows):
-    corpus = []
-    row_ids = []
+    texts = [build_search_text(r) for r in rows]
+    row_ids = [r[0] for r in rows]
+
+    return InvertedBM25.build(texts, row_ids)
+
+
+def file_signature(path):
+    stat = Path(path).stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def db_signature():
+    # In WAL mode (db_books_load.py) committed edits stay in books.db-wal
+    # until a checkpoint, which open readers can hold off indefinitely, so
+    # books.db alone may not change at all. An empty WAL holds no edits: it
+    # is what any reader (e.g. the API's read-only pool) creates on open, so
+    # it counts the same as none.
+    wal = DB_PATH.with_name(f"{DB_PATH.name}-wal")
+    signature = file_signature(DB_PATH)
+    try:
+        wal_signature = file_signature(wal)
+    except FileNotFoundError:  # checkpointed and removed by the last writer
+        wal_signature = None
+    if wal_signature is not None and wal_signature["size"] == 0:
+        wal_signature = None
+    signature["wal"] = wal_signature
+    return signature
+
+
+def index_version():
+    # changes whenever the DB or any served search artifact is rewritten
+    paths = [
+        EMBEDDINGS_FILE,
+        store_paths(EMBEDDINGS_FILE, EMBEDDING_STORE_DTYPE)[0],
+        ROW_IDS_FILE,
+        BM25_INDEX_DIR / "header.json",
+        METADATA_DIR / "header.json",
+        FACETS_DIR / "header.json",
+    ]
+    sources = {str(p): file_signature(p) if p.exists() else None for p in paths}
+    sources["db"] = db_signature()
+
+    digest = hashlib.sha1(json.dumps(sources, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def load_or_build_bm25_index(rows):
+    with artifact_lock():
+        source = {"db": db_signature(), "n_docs": len(rows)}
+
+        header = read_bm25_header(BM25_INDEX_DIR)
+        if header is not None and header.get("source") == source:
+            index = load_bm25_index(BM25_INDEX_DIR)
+            if index is not None:
+                return index
+
+        print("[INFO] BM25 index missing or stale. Rebuilding from DB...")
+        index = build_bm25_index(rows)
+        save_bm25_index(index, BM25_INDEX_DIR, source=source)
+        return index
+
+
+# -------------------------------
+# RESULT METADATA
+# -------------------------------
+def load_or_build_metadata(rows):
+    with artifact_lock():
+        if METADATA_STORE == "sqlite":
+            return SqliteMetadata(DB_PATH)
+        if METADATA_STORE != "columnar":
+            raise ValueError(f"Unsupported metadata store: {METADATA_STORE}")
+
+        source = {"db": db_signature(), "n_rows": len(rows)}
+        metadata = ColumnarMetadata.load(METADATA_DIR, source=source)
+        if metadata is not None:
+            return metadata
+
+        print("[INFO] Metadata store missing or stale. Rebuilding from DB...")
+        metadata = ColumnarMetadata.from_rows(rows)
+        metadata.save(METADATA_DIR, source=source)
+        return ColumnarMetadata.load(METADATA_DIR)
+
+
+# -------------------------------
+# SEARCH FILTERS
+# -------------------------------
+def load_or_build_facets(rows, emb_row_ids):
+    # facet columns are aligned to the embedding rows they filter
+    with artifact_lock():
+        source = {"db": db_signature(), "n_rows": len(emb_row_ids)}
+        facets = load_facet_index(FACETS_DIR, source=source)
+        if facets is not None and np.array_equal(facets.row_ids, emb_row_ids):
+            return facets
 
-    for r in rows:
-        text = build_search_text(r).lower()
-        corpus.append(text.split())
-        row_ids.append(r[0])
+        print("[INFO] Facet index missing or stale. Rebuilding from DB...")
+        facets = FacetIndex.build(rows, emb_row_ids)
+        save_facet_index(facets, FACETS_DIR, source=source)
+        return facets
 
-    return BM25Okapi(corpus), row_ids
+
+# -------------------------------
+# DENSE INDEX
+# -------------------------------
+def embeddings_source():
+    return file_signature(EMBEDDINGS_FILE) if EMBEDDINGS_FILE.exists() else None
+
+
+def load_configured_dense_index(embeddings):
+    with artifact_lock():
+        return load_dense_index(
+            embeddings,
+            EMBEDDINGS_FILE,
+            kind=DENSE_INDEX,
+            nprobe=IVF_NPROBE,
+            rescore=REDUCED_RESCORE if DENSE_INDEX == "reduced" else BINARY_RESCORE,
+            reduced_dim=REDUCED_DIM,
+            reduced_method=REDUCED_METHOD,
+            source=embeddings_source(),
+        )
+
+
+# -------------------------------
+# SIMILAR BOOKS
+# -------------------------------
+def load_or_build_similarity_graph(embeddings):
+    # The graph is opt-in (python -m src.search.similarity_graph), but once
+    # built it follows the embeddings: a stale one is rebuilt here rather than
+    # leaving similar_books on the exact-scan fallback. Returns (graph, state).
+    with artifact_lock():
+        source = embeddings_source()
+        state = similarity_graph_state(EMBEDDINGS_FILE, len(embeddings), source)
+        if state == "missing":
+            return None, state
+
+        if state == "stale":
+            print("[INFO] Similarity graph is stale. Rebuilding...")
+            graph = build_similarity_graph(embeddings, EMBEDDINGS_FILE, source=source)
+        else:
+            graph = SimilarityGraph.load(EMBEDDINGS_FILE, len(embeddings), source)
+        return graph, "ready" if graph is not None else "stale"
+
+
+# -------------------------------
+# SHARED ARTIFACTS (MULTI-WORKER)
+# -------------------------------
+def artifact_state():
+    # what a prepare produces: the artifact versions plus the served index
+    return {
+        "version": index_version(),
+        "dense_index": [DENSE_INDEX, REDUCED_DIM, REDUCED_METHOD],
+    }
+
+
+def prepared_state():
+    if not ARTIFACT_READY_FILE.exists():
+        return None
+    try:
+        return json.loads(ARTIFACT_READY_FILE.read_text())
+    except ValueError:
+        return None
+
+
+def _prepare_search_artifacts():
+    rows = load_books_from_db()
+    embeddings, emb_row_ids = load_or_build_embeddings(rows)
+
+    load_or_build_bm25_index(rows)
+    load_or_build_metadata(rows)
+    load_or_build_facets(rows, emb_row_ids)
+    load_configured_dense_index(embeddings)
+    load_or_build_similarity_graph(embeddings)
+
+    state = artifact_state()
+    tmp = ARTIFACT_READY_FILE.with_name(f"{ARTIFACT_READY_FILE.name}.tmp-{os.getpid()}")
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, ARTIFACT_READY_FILE)
+    return state
+
+
+def prepare_search_artifacts():
+    # builds or refreshes every file the engine serves from, once, under the
+    # artifact lock; run before starting several workers
+    with artifact_lock():
+        return _prepare_search_artifacts()
+
+
+def attach_search_engine(model=None):
+    # Read-only attach for worker processes: nothing is rebuilt unless the
+    # DB or an artifact changed since the last prepare, and every array is
+    # opened as an mmap of the same files, so N workers share one copy
+    # through the page cache instead of loading the catalog N times.
+    # The artifacts are opened while the lock is held: a concurrent prepare
+    # swaps whole directories, and an open mmap keeps reading the old files.
+    with artifact_lock():
+        if prepared_state() != artifact_state():
+            print("[INFO] Search artifacts missing or stale. Preparing...")
+            _prepare_search_artifacts()
+
+        embeddings = load_embedding_store(
+            EMBEDDINGS_FILE, EMBEDDING_STORE_DTYPE, mmap=True
+        )
+        emb_row_ids = np.load(ROW_IDS_FILE, mmap_mode="r")
+        dense_index = load_configured_dense_index(embeddings)
+        bm25 = load_bm25_index(BM25_INDEX_DIR)
+        facets = load_facet_index(FACETS_DIR, mmap=True)
+
+        if METADATA_STORE == "sqlite":
+            metadata = SqliteMetadata(DB_PATH)
+        else:
+            metadata = ColumnarMetadata.load(METADATA_DIR)
+
+    missing = [
+        name
+        for name, artifact in (
+            ("BM25 index", bm25),
+            ("facet index", facets),
+            ("metadata store", metadata),
+        )
+        if artifact is None
+    ]
+    if missing:
+        raise RuntimeError(
+            f"Could not open prepared search artifacts: {', '.join(missing)}. "
+            "Run python -m src.search.prepare_index."
+        )
+
+    return SemanticSearchEngine(
+        None,
+        embeddings,
+        emb_row_ids,
+        dense_index=dense_index,
+        bm25=bm25,
+        metadata=metadata,
+        facets=facets,
+        model=model,
+    )
+
+
+def touch_pages(*objects):
+    # reads one value per page of every array attribute, so mmapped
+    # artifacts are in the page cache before the first real query
+    touched = 0
+    for obj in objects:
+        for value in getattr(obj, "__dict__", {}).values():
+            if isinstance(value, np.ndarray) and value.size:
+                step = max(1, WARM_UP_PAGE_BYTES // value.itemsize)
+                value.reshape(-1)[::step].sum()
+                touched += value.nbytes
+    return touched
+
+
+# -------------------------------
+# SCORE FUSION
+# -------------------------------
+def min_max(scores, mask=None):
+    # scaled to [0, 1] over the eligible rows
+    eligible = scores if mask is None else scores[mask]
+    if not len(eligible):
+        return np.zeros_like(scores)
+
+    lo, hi = eligible.min(), eligible.max()
+    if hi <= lo:
+        return np.zeros_like(scores)
+    return (scores - lo) / (hi - lo)
+
+
+def weighted_fuse(dense, sparse, alpha, mask=None):
+    fused = alpha * min_max(dense, mask) + (1 - alpha) * min_max(sparse, mask)
+    if mask is not None:
+        fused[~mask] = -np.inf
+    return fused
+
+
+def rrf_fuse(dense, sparse, mask=None, k=RRF_K, depth=RRF_DEPTH):
+    # ranks only matter near the top, so each list contributes its top
+    # `depth` rows (found with argpartition) instead of a full sort; BM25
+    # only ranks rows that matched a query term
+    fused = np.zeros(len(dense), dtype=np.float32)
+    matched = sparse > 0 if mask is None else (sparse > 0) & mask
+
+    for scores, listed in ((dense, mask), (sparse, matched)):
+        if listed is None:
+            ranked = top_k_desc(scores, depth)
+        else:
+            rows = np.flatnonzero(listed)
+            ranked = rows[top_k_desc(scores[rows], depth)]
+        fused[ranked] += 1.0 / (k + np.arange(1, len(ranked) + 1))
+
+    return fused
 
 
 # -------------------------------
 # SEARCH ENGINE
 # -------------------------------
 class SemanticSearchEngine:
-    def __init__(self, rows, embeddings, emb_row_ids):
-        self.rows = rows
-        self.embeddings = embeddings
+    # rows are only read while building or validating artifacts; nothing
+    # keeps a reference to them afterwards
+    def __init__(
+        self,
+        rows,
+        embeddings,
+        emb_row_ids,
+        dense_index=None,
+        bm25=None,
+        metadata=None,
+        facets=None,
+        model=None,
+    ):
+        self.embeddings = as_embedding_store(embeddings)
         self.emb_row_ids = emb_row_ids
 
-        self.row_id_to_meta = {
-            r[0]: {
-                "isbn": r[1],
-                "title": r[2],
-                "author": r[3],
-                "year": r[4],
-                "publisher": r[5],
-                "description": r[6],
-                "subjects": r[7],
-            }
-            for r in rows
+        self.dense_index = dense_index or load_configured_dense_index(self.embeddings)
+        self.exact_index = ExactIndex(self.embeddings)
+
+        # built offline (python -m src.search.similarity_graph) and refreshed
+        # with the embeddings; without it similar_books falls back to an exact
+        # scan with the stored vector
+        self.similar, self.similar_state = load_or_build_similarity_graph(
+            self.embeddings
+        )
+
+        self.metadata = metadata or load_or_build_metadata(rows)
+
+        self._emb_order = np.argsort(emb_row_ids, kind="stable")
+        self._emb_sorted_ids = np.asarray(emb_row_ids)[self._emb_order]
+
+        self.bm25 = bm25 or load_or_build_bm25_index(rows)
+        # BM25 document position -> embedding row (-1 if the row has none)
+        self.bm25_emb_idx = self.emb_indices(self.bm25.row_ids)
+        self.facets = facets or load_or_build_facets(rows, emb_row_ids)
+
+        # a reloaded engine reuses the serving engine's model
+        self.model = model or load_query_model()
+        self.batcher = None
+        self.shards = None
+        self.query_cache = (
+            QueryEmbeddingCache(QUERY_CACHE_ENTRIES, QUERY_CACHE_MAX_BYTES or None)
+            if QUERY_CACHE_ENTRIES > 0
+            else None
+        )
+        self.result_cache = (
+            ResultCache(index_version, RESULT_CACHE_ENTRIES, RESULT_CACHE_FILE)
+            if RESULT_CACHE_ENTRIES > 0
+            else None
+        )
+        self.version = index_version()
+
+    def warm_up(self, queries=None):
+        # pre-faults the served arrays and runs the warm-up queries down each
+        # path, bypassing the result cache
+        queries = WARM_UP_QUERIES if queries is None else list(queries)
+        started = time.perf_counter()
+        touched = touch_pages(
+            self.embeddings, self.dense_index, self.bm25, self.bm25.vocab, self.facets
+        )
+        if queries:
+            self._embedding_only_search_batch(queries, TOP_K, False, None, None)
+            self._hybrid_search_batch(queries, TOP_K, None)
+            self._fused_search_batch(queries, TOP_K, FUSION_METHOD, FUSION_ALPHA, None)
+
+        elapsed = time.perf_counter() - started
+        print(
+            f"[INFO] Engine warm: {touched / 1e6:.1f} MB touched, "
+            f"{len(queries)} queries in {elapsed:.2f}s"
+        )
+
+    def enable_micro_batching(self, window_ms, max_batch):
+        # concurrent callers (e.g. API threads) share forward passes
+        self.batcher = MicroBatcher(
+            self._encode, window_ms=window_ms, max_batch=max_batch
+        )
+
+    def enable_sharding(self, n_shards):
+        # semantic and hybrid queries fan out to n_shards worker processes,
+        # each holding one row_id range; the model stays in this process.
+        # Started under the artifact lock so no prepare swaps files while the
+        # shards load them.
+        spec = {
+            "embeddings_file": str(EMBEDDINGS_FILE.resolve()),
+            "dtype": EMBEDDING_STORE_DTYPE,
+            "row_ids_file": str(ROW_IDS_FILE.resolve()),
+            "bm25_dir": str(BM25_INDEX_DIR.resolve()),
+            "facets_dir": str(FACETS_DIR.resolve()),
         }
+        with artifact_lock():
+            self.shards = ShardedSearch(spec, self.emb_row_ids, n_shards)
+
+    def similar_stats(self):
+        stats = {"state": self.similar_state}
+        if self.similar is not None:
+            stats.update(rows=len(self.similar), k=self.similar.k)
+        return stats
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.shards is not None:
+            self.shards.close()
+        if isinstance(self.metadata, SqliteMetadata):
+            self.metadata.close()
 
-        self.row_id_to_emb_idx = {rid: i for i, rid in enumerate(emb_row_ids)}
+    def encode_queries(self, queries):
+        queries = list(queries)
+        if self.query_cache is None:
+            return self._encode_uncached(queries)
 
-        self.bm25, self.bm25_row_ids = build_bm25_index(rows)
+        cached = [self.query_cache.get(q) for q in queries]
+        missing = [i for i, emb in enumerate(cached) if emb is None]
 
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device)
+        if missing:
+            fresh = self._encode_uncached([queries[i] for i in missing])
+            for i, emb in zip(missing, fresh):
+                self.query_cache.put(queries[i], emb)
+                cached[i] = emb
 
-    def embedding_only_search(self, query, top_k=TOP_K):
-        q_emb = self.model.encode(
-            query,
+        return np.stack(cached)
+
+    def _encode_uncached(self, queries):
+        if self.batcher is not None:
+            return self.batcher.encode(queries)
+        return self._encode(queries)
+
+    def _encode(self, queries):
+        # one batched forward pass for all queries
+        return self.model.encode(
+            list(queries),
+            batch_size=QUERY_BATCH_SIZE,
             convert_to_numpy=True,
             normalize_embeddings=True,
         )
 
-        scores = np.dot(self.embeddings, q_emb)
-        top_idx = np.argsort(scores)[::-1][:top_k]
+    def filter_mask(self, filters):
+        # boolean mask over embedding rows, or None when nothing is filtered
+        return self.facets.mask(filters)
 
-        return self._format_results(top_idx, scores)
+    def embedding_only_search(
+        self, query, top_k=TOP_K, exact=False, nprobe=None, filters=None
+    ):
+        return self.embedding_only_search_batch(
+            [query], top_k=top_k, exact=exact, nprobe=nprobe, filters=filters
+        )[0]
 
-    def hybrid_search(self, query, top_k=TOP_K):
-        tokens = query.lower().split()
-        bm25_scores = self.bm25.get_scores(tokens)
+    def embedding_only_search_batch(
+        self, queries, top_k=TOP_K, exact=False, nprobe=None, filters=None
+    ):
+        filters = clean_filters(filters)
+        params = {"top_k": top_k, "exact": exact, "nprobe": nprobe, "filters": filters}
+        return self._cached_search(
+            queries,
+            "semantic",
+            params,
+            lambda qs: self._embedding_only_search_batch(
+                qs, top_k, exact, nprobe, filters
+            ),
+        )
 
-        top_bm25_idx = np.argsort(bm25_scores)[::-1][:BM25_CANDIDATES]
-        candidate_ids = [self.bm25_row_ids[i] for i in top_bm25_idx]
+    def _embedding_only_search_batch(self, queries, top_k, exact, nprobe, filters):
+        q_embs = self.encode_queries(queries)
 
-        q_emb = self.model.encode(
-            query,
-            convert_to_numpy=True,
-            normalize_embeddings=True,
+        # shards always scan exactly and apply filters on their own rows
+        if self.shards is not None:
+            hits = self.shards.search_batch(q_embs, top_k, filters)
+        else:
+            index = self.exact_index if exact else self.dense_index
+            mask = self.filter_mask(filters)
+            hits = index.search_batch(q_embs, top_k, nprobe=nprobe, mask=mask)
+
+        return [
+            self._format_results(top_idx, scores, direct_scores=True)
+            for top_idx, scores in hits
+        ]
+
+    def hybrid_search(self, query, top_k=TOP_K, filters=None):
+        return self.hybrid_search_batch([query], top_k=top_k, filters=filters)[0]
+
+    def hybrid_search_batch(self, queries, top_k=TOP_K, filters=None):
+        filters = clean_filters(filters)
+        return self._cached_search(
+            queries,
+            "hybrid",
+            {"top_k": top_k, "filters": filters},
+            lambda qs: self._hybrid_search_batch(qs, top_k, filters),
         )
 
-        scored = []
-        for rid in candidate_ids:
-            emb_idx = self.row_id_to_emb_idx.get(rid)
-            if emb_idx is None:
-                continue
-            sim = float(np.dot(self.embeddings[emb_idx], q_emb))
-            scored.append((emb_idx, sim))
+    def _hybrid_search_batch(self, queries, top_k, filters):
+        if self.shards is not None:
+            hits = self.shards.hybrid_batch(
+                [tokenize(q) for q in queries],
+                self.encode_queries(queries),
+                BM25_CANDIDATES,
+                top_k,
+                filters,
+            )
+            return [
+                self._format_results(idx, scores, direct_scores=True)
+                for idx, scores in hits
+            ]
 
-        scored.sort(key=lambda x: x[1], reverse=True)
-        top = scored[:top_k]
+        # BM25 documents inherit the filter through their embedding row
+        mask = self.filter_mask(filters)
+        if mask is not None:
+            mask = (self.bm25_emb_idx >= 0) & mask[self.bm25_emb_idx]
 
-        return self._format_results(
-            [i for i, _ in top],
-            np.array([s for _, s in top]),
-            direct_scores=True,
+        # only documents sharing a query term are scored
+        candidates = self.bm25.top_n_batch(
+            [tokenize(q) for q in queries], BM25_CANDIDATES, mask=mask
         )
+        q_embs = self.encode_queries(queries)
+
+        return [
+            self._rerank(top_bm25_idx, q_emb, top_k)
+            for (top_bm25_idx, _), q_emb in zip(candidates, q_embs)
+        ]
+
+    def fused_search(self, query, top_k=TOP_K, method=None, alpha=None, filters=None):
+        return self.fused_search_batch(
+            [query], top_k=top_k, method=method, alpha=alpha, filters=filters
+        )[0]
+
+    def fused_search_batch(
+        self, queries, top_k=TOP_K, method=None, alpha=None, filters=None
+    ):
+        method = method or FUSION_METHOD
+        alpha = FUSION_ALPHA if alpha is None else alpha
+        if method not in ("weighted", "rrf"):
+            raise ValueError(f"Unknown fusion method: {method}")
+
+        filters = clean_filters(filters)
+        params = {"top_k": top_k, "method": method, "alpha": alpha, "filters": filters}
+        return self._cached_search(
+            queries,
+            "fused",
+            params,
+            lambda qs: self._fused_search_batch(qs, top_k, method, alpha, filters),
+        )
+
+    def _fused_search_batch(self, queries, top_k, method, alpha, filters):
+        # dense and BM25 scores for every embedding row, fused, then one
+        # partial sort; no candidate cap, so books without lexical overlap
+        # can still surface
+        mask = self.filter_mask(filters)
+        q_embs = self.encode_queries(queries)
+        matches = self.bm25.match_batch([tokenize(q) for q in queries])
 
-    def _format_results(self, indices, scores, direct_scores=False):
         results = []
+        for start in range(0, len(queries), QUERY_BATCH_SIZE):
+            block = self.embeddings.scores(q_embs[start : start + QUERY_BATCH_SIZE])
 
-        for rank, idx in enumerate(indices):
-            rid = int(self.emb_row_ids[idx])
-            meta = self.row_id_to_meta[rid]
+            for dense, (docs, bm25_scores) in zip(
+                block, matches[start : start + QUERY_BATCH_SIZE]
+            ):
+                # BM25 documents -> embedding rows; unmatched rows score 0
+                emb_idx = self.bm25_emb_idx[docs]
+                keep = emb_idx >= 0
+                sparse = np.zeros(len(dense), dtype=np.float32)
+                sparse[emb_idx[keep]] = bm25_scores[keep]
 
-            score = scores[rank] if direct_scores else scores[idx]
+                if method == "rrf":
+                    fused = rrf_fuse(dense, sparse, mask)
+                else:
+                    fused = weighted_fuse(dense, sparse, alpha, mask)
 
-            results.append(
-                {
-                    "row_id": rid,
-                    "isbn": meta["isbn"],
-                    "title": meta["title"],
-                    "author": meta["author"],
-                    "year": meta["year"],
-                    "publisher": meta["publisher"],
-                    "description": meta["description"],
-                    "subjects": meta["subjects"],
-                    "score": float(score),
-                }
-            )
+                # ineligible rows sit at -inf (weighted) or 0 (rrf)
+                top = top_k_desc(fused, top_k)
+                top = top[fused[top] > (0 if method == "rrf" else -np.inf)]
+                results.append(
+                    self._format_results(top, fused[top], direct_scores=True)
+                )
+
+        return results
+
+    def similar_books(self, row_id, top_k=TOP_K):
+        # "more like this" from stored vectors only: no model inference.
+        # Returns None when the book has no embedding.
+        emb_idx = int(self.emb_indices([row_id])[0])
+        if emb_idx < 0:
+            return None
+
+        if self.similar is not None and top_k <= self.similar.k:
+            idx, scores = self.similar.lookup(emb_idx, top_k)
+        else:
+            idx, scores = self.exact_index.search(self.embeddings[emb_idx], top_k + 1)
+            keep = idx != emb_idx
+            idx, scores = idx[keep][:top_k], scores[keep][:top_k]
+
+        return self._format_results(idx, scores, direct_scores=True)
+
+    def _cached_search(self, queries, mode, params, search_fn):
+        queries = list(queries)
+        if self.result_cache is None:
+            return search_fn(queries)
+
+        results = [self.result_cache.get(q, mode, params) for q in queries]
+        missing = [i for i, r in enumerate(results) if r is None]
+
+        if missing:
+            fresh = search_fn([queries[i] for i in missing])
+            for i, r in zip(missing, fresh):
+                self.result_cache.put(queries[i], mode, params, r)
+                results[i] = r
+
+        return results
+
+    def emb_indices(self, row_ids):
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        if not len(self._emb_sorted_ids):
+            return np.full(len(row_ids), -1, dtype=np.int64)
+
+        pos = np.searchsorted(self._emb_sorted_ids, row_ids)
+        pos = np.minimum(pos, len(self._emb_sorted_ids) - 1)
+
+        found = self._emb_sorted_ids[pos] == row_ids
+        return np.where(found, self._emb_order[pos], -1)
+
+    def _rerank(self, top_bm25_idx, q_emb, top_k):
+        emb_idx = self.bm25_emb_idx[top_bm25_idx]
+        emb_idx = emb_idx[emb_idx >= 0]
+
+        sims = self.embeddings.gather_scores(emb_idx, q_emb)
+        top = top_k_desc(sims, top_k)
+
+        return self._format_results(emb_idx[top], sims[top], direct_scores=True)
+
+    def _format_results(self, indices, scores, direct_scores=False):
+        row_ids = [int(self.emb_row_ids[idx]) for idx in indices]
+        metas = self.metadata.get_many(row_ids)
+
+        results = []
+        for rank, (idx, rid, meta) in enumerate(zip(indices, row_ids, metas)):
+            if meta is None:
+                continue
+
+            score = scores[rank] if direct_scores else scores[idx]
+            results.append({"row_id": rid, **meta, "score": float(score)})
 
         return results
 
@@ -0,0 +1,218 @@
+import hashlib
+import multiprocessing as mp
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from src.search.ann_index import ExactIndex, top_k_desc
+from src.search.bm25_index import load_bm25_index
+from src.search.embedding_store import EmbeddingStore, load_embedding_store
+from src.search.facets import load_facet_index
+
+
+# -------------------------------
+# PARTITIONING
+# -------------------------------
+def shard_bounds(row_ids, n_shards):
+    # contiguous row_id ranges [lo, hi) holding roughly equal row counts
+    parts = [p for p in np.array_split(np.sort(row_ids), n_shards) if len(p)]
+    bounds = [int(p[0]) for p in parts] + [int(parts[-1][-1]) + 1]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def row_positions(row_ids, lookup):
+    # index of each lookup id in row_ids, -1 where absent
+    order = np.argsort(row_ids, kind="stable")
+    if not len(order):
+        return np.full(len(lookup), -1, dtype=np.int64)
+
+    sorted_ids = row_ids[order]
+    pos = np.minimum(np.searchsorted(sorted_ids, lookup), len(order) - 1)
+    return np.where(sorted_ids[pos] == lookup, order[pos], -1)
+
+
+def row_ids_digest(row_ids):
+    data = np.ascontiguousarray(row_ids, dtype=np.int64).tobytes()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def slice_store(store, rows):
+    # a contiguous run of rows stays a view of the mmapped file
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+        rows = slice(int(rows[0]), int(rows[-1]) + 1)
+
+    scales = store.scales[rows] if store.scales is not None else None
+    return EmbeddingStore(store.matrix[rows], scales)
+
+
+# -------------------------------
+# SHARD (runs in its own process)
+# -------------------------------
+class Shard:
+    # One row_id range of the catalog: its embedding rows, its BM25 postings
+    # (with the global idf, so scores compare across shards) and its facets.
+    # Results are returned as global embedding row indices, so the files must
+    # be the ones the coordinator loaded (checked through its row ids).
+    def __init__(self, spec):
+        lo, hi = spec["row_range"]
+
+        emb_row_ids = np.load(spec["row_ids_file"])
+        store = load_embedding_store(spec["embeddings_file"], spec["dtype"])
+        if (
+            row_ids_digest(emb_row_ids) != spec["row_ids_digest"]
+            or len(store) != len(emb_row_ids)
+        ):
+            raise RuntimeError(
+                "Shard artifacts do not match the coordinator's embedding rows "
+                "(the index changed while shards were starting)"
+            )
+
+        self.rows = np.flatnonzero((emb_row_ids >= lo) & (emb_row_ids < hi))
+        self.embeddings = slice_store(store, self.rows)
+        self.index = ExactIndex(self.embeddings)
+
+        bm25 = load_bm25_index(spec["bm25_dir"])
+        bm25_row_ids = np.asarray(bm25.row_ids)
+        docs = np.flatnonzero((bm25_row_ids >= lo) & (bm25_row_ids < hi))
+        self.bm25 = bm25.subset(docs)
+
+        # shard BM25 doc -> shard embedding row (-1 if the row has none)
+        self.bm25_emb_idx = row_positions(emb_row_ids[self.rows], self.bm25.row_ids)
+
+        facets = load_facet_index(spec["facets_dir"])
+        self.facets = facets.subset(self.rows) if facets is not None else None
+
+    def mask(self, filters):
+        if not filters or self.facets is None:
+            return None
+        return self.facets.mask(filters)
+
+    def dense(self, q_embs, top_k, filters):
+        hits = self.index.search_batch(q_embs, top_k, mask=self.mask(filters))
+        return [(self.rows[idx], scores) for idx, scores in hits]
+
+    def hybrid(self, token_lists, q_embs, n_candidates, filters):
+        # this shard's BM25 top-n with the dense score of each candidate;
+        # candidates without an embedding keep index -1
+        mask = self.mask(filters)
+        if mask is not None:
+            mask = (self.bm25_emb_idx >= 0) & mask[self.bm25_emb_idx]
+
+        results = []
+        candidates = self.bm25.top_n_batch(token_lists, n_candidates, mask=mask)
+        for (docs, bm25_scores), q_emb in zip(candidates, q_embs):
+            emb_idx = self.bm25_emb_idx[docs]
+            has_emb = emb_idx >= 0
+
+            dense = np.full(len(docs), -np.inf, dtype=np.float32)
+            dense[has_emb] = self.embeddings.gather_scores(emb_idx[has_emb], q_emb)
+            global_idx = np.where(has_emb, self.rows[np.maximum(emb_idx, 0)], -1)
+
+            results.append((bm25_scores, global_idx, dense))
+
+        return results
+
+
+_shard = None
+_shard_spec = None
+
+
+def _init_shard(spec):
+    # the shard itself is loaded by the first call, so a load error reaches
+    # the coordinator as that call's exception instead of a broken pool
+    global _shard_spec
+    _shard_spec = spec
+
+
+def _shard_info():
+    global _shard
+    if _shard is None:
+        _shard = Shard(_shard_spec)
+    return {"rows": len(_shard.rows), "bm25_docs": len(_shard.bm25)}
+
+
+def _shard_dense(q_embs, top_k, filters):
+    return _shard.dense(q_embs, top_k, filters)
+
+
+def _shard_hybrid(token_lists, q_embs, n_candidates, filters):
+    return _shard.hybrid(token_lists, q_embs, n_candidates, filters)
+
+
+# -------------------------------
+# COORDINATOR
+# -------------------------------
+class ShardedSearch:
+    # Each shard lives in its own single-worker process pool, so a shard's
+    # arrays are loaded once and every request for it lands on that process.
+    # Queries are scattered to all shards in parallel and the per-shard top-k
+    # lists are merged.
+    def __init__(self, spec, emb_row_ids, n_shards):
+        ctx = mp.get_context("spawn")
+        self.bounds = shard_bounds(emb_row_ids, n_shards)
+        digest = row_ids_digest(emb_row_ids)
+        self.pools = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=ctx,
+                initializer=_init_shard,
+                initargs=({**spec, "row_range": bounds, "row_ids_digest": digest},),
+            )
+            for bounds in self.bounds
+        ]
+        try:
+            self.info = self._scatter(_shard_info)
+        except Exception:
+            self.close()
+            raise
+
+        print(
+            f"[INFO] Sharded search: {len(self.pools)} shards, "
+            f"rows per shard {[i['rows'] for i in self.info]}"
+        )
+
+    def _scatter(self, fn, *args):
+        futures = [pool.submit(fn, *args) for pool in self.pools]
+        return [f.result() for f in futures]
+
+    def search_batch(self, q_embs, top_k, filters=None):
+        per_shard = self._scatter(_shard_dense, q_embs, top_k, filters)
+
+        results = []
+        for hits in zip(*per_shard):
+            idx = np.concatenate([h[0] for h in hits])
+            scores = np.concatenate([h[1] for h in hits])
+            best = top_k_desc(scores, top_k)
+            results.append((idx[best], scores[best]))
+
+        return results
+
+    def hybrid_batch(self, token_lists, q_embs, n_candidates, top_k, filters=None):
+        per_shard = self._scatter(
+            _shard_hybrid, token_lists, q_embs, n_candidates, filters
+        )
+
+        results = []
+        for hits in zip(*per_shard):
+            bm25_scores = np.concatenate([h[0] for h in hits])
+            idx = np.concatenate([h[1] for h in hits])
+            dense = np.concatenate([h[2] for h in hits])
+
+            # global BM25 top-n as in the unsharded path, reranked by dense
+            cand = top_k_desc(bm25_scores, n_candidates)
+            cand = cand[idx[cand] >= 0]
+            best = cand[top_k_desc(dense[cand], top_k)]
+            results.append((idx[best], dense[best]))
+
+        return results
+
+    def stats(self):
+        return {
+            "shards": len(self.pools),
+            "row_ranges": self.bounds,
+            "rows": [i["rows"] for i in self.info],
+            "bm25_docs": [i["bm25_docs"] for i in self.info],
+        }
+
+    def close(self):
+        for pool in self.pools:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,143 @@
+import json
+import os
+import time
+import numpy as np
+from pathlib import Path
+
+from src.search.embedding_store import as_embedding_store
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+SIMILAR_K = int(os.environ.get("SIMILAR_K", "20"))
+
+# float32 scores held in memory per block of source rows (~128 MB)
+SIMILAR_SCORE_BUDGET = 1 << 25
+
+
+def similar_paths(embeddings_file):
+    stem = Path(embeddings_file).with_suffix("")
+    return {
+        "meta": stem.with_name(f"{stem.name}.similar.json"),
+        "neighbors": stem.with_name(f"{stem.name}.similar.ids.npy"),
+        "scores": stem.with_name(f"{stem.name}.similar.scores.npy"),
+    }
+
+
+def similarity_graph_state(embeddings_file, n_rows, source=None):
+    # "missing" (never built), "stale" (built for other embeddings) or "ready"
+    paths = similar_paths(embeddings_file)
+    if not all(p.exists() for p in paths.values()):
+        return "missing"
+
+    meta = json.loads(paths["meta"].read_text())
+    if meta["n_rows"] != n_rows or meta.get("source") != source:
+        return "stale"
+    return "ready"
+
+
+# -------------------------------
+# GRAPH
+# -------------------------------
+class SimilarityGraph:
+    # row i of neighbors holds the embedding rows most similar to row i,
+    # best first, padded with -1 when the catalog has fewer than k others
+    def __init__(self, neighbors, scores):
+        self.neighbors = neighbors
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.neighbors)
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    def lookup(self, emb_idx, top_k):
+        idx = np.asarray(self.neighbors[emb_idx, :top_k], dtype=np.int64)
+        scores = np.asarray(self.scores[emb_idx, :top_k], dtype=np.float32)
+        keep = idx >= 0
+        return idx[keep], scores[keep]
+
+    @classmethod
+    def load(cls, embeddings_file, n_rows, source=None):
+        state = similarity_graph_state(embeddings_file, n_rows, source)
+        if state == "missing":
+            return None
+        if state == "stale":
+            print("[WARN] Similarity graph is stale (embeddings changed). Ignoring it.")
+            return None
+
+        paths = similar_paths(embeddings_file)
+        return cls(
+            np.load(paths["neighbors"], mmap_mode="r"),
+            np.load(paths["scores"], mmap_mode="r"),
+        )
+
+
+def build_similarity_graph(embeddings, embeddings_file, k=SIMILAR_K, source=None):
+    # Exact all-pairs top-k, one block of source rows at a time: memory is
+    # bounded by SIMILAR_SCORE_BUDGET plus the output memmaps.
+    store = as_embedding_store(embeddings)
+    n = len(store)
+    k = max(1, min(k, n - 1))
+    block_rows = max(1, SIMILAR_SCORE_BUDGET // max(n, 1))
+
+    paths = similar_paths(embeddings_file)
+    tmp = {
+        name: path.with_name(f"{path.stem}.tmp-{os.getpid()}.npy")
+        for name, path in paths.items()
+        if name != "meta"
+    }
+    neighbors = np.lib.format.open_memmap(
+        tmp["neighbors"], mode="w+", dtype=np.int32, shape=(n, k)
+    )
+    scores = np.lib.format.open_memmap(
+        tmp["scores"], mode="w+", dtype=np.float16, shape=(n, k)
+    )
+
+    started = time.perf_counter()
+    for lo in range(0, n, block_rows):
+        hi = min(lo + block_rows, n)
+        block = store.scores(store[lo:hi])
+        block[np.arange(hi - lo), np.arange(lo, hi)] = -np.inf
+
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        # the row itself (-inf) only lands in the top-k when n <= k
+        top[~np.isfinite(top_scores)] = -1
+        neighbors[lo:hi] = top
+        scores[lo:hi] = np.where(top >= 0, top_scores, 0)
+
+    neighbors.flush()
+    scores.flush()
+    del neighbors, scores
+
+    # readers may have the old graph memory-mapped, so swap files in
+    for name, path in tmp.items():
+        os.replace(path, paths[name])
+    meta = {"n_rows": n, "k": k, "dim": store.dim, "source": source}
+    paths["meta"].write_text(json.dumps(meta))
+
+    elapsed = time.perf_counter() - started
+    print(f"[INFO] Similarity graph: {n} rows x {k} neighbours in {elapsed:.1f}s")
+
+    return SimilarityGraph.load(embeddings_file, n, source=source)
+
+
+if __name__ == "__main__":
+    from src.search.embedding_store import load_embedding_store
+    from src.search.semantic_search import (
+        EMBEDDING_STORE_DTYPE,
+        EMBEDDINGS_FILE,
+        artifact_lock,
+        embeddings_source,
+    )
+
+    with artifact_lock():
+        store = load_embedding_store(EMBEDDINGS_FILE, EMBEDDING_STORE_DTYPE)
+        build_similarity_graph(store, EMBEDDINGS_FILE, source=embeddings_source())
@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+# -------------------------------
+# CONFIG
+# -------------------------------
+# per connection: bytes of the DB file memory-mapped, page cache size in KiB
+# and prepared statements kept by the sqlite3 module
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 << 20)))
+SQLITE_CACHE_KB = int(os.environ.get("SQLITE_CACHE_KB", "16384"))
+SQLITE_STATEMENT_CACHE = int(os.environ.get("SQLITE_STATEMENT_CACHE", "256"))
+
+
+# -------------------------------
+# POOL
+# -------------------------------
+class SqlitePool:
+    # One read-only connection per thread, opened on first use and reused by
+    # every later request on that thread (FastAPI runs sync handlers on a
+    # fixed thread pool). A thread reopens its connection when the DB file
+    # is replaced or the pool is closed.
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+        self._generation = 0
+        self.opened = 0
+        self.reopened = 0
+        self.checkouts = 0
+
+    def _open(self):
+        conn = sqlite3.connect(
+            f"{self.db_path.resolve().as_uri()}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            cached_statements=SQLITE_STATEMENT_CACHE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_KB}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def connection(self):
+        st = os.stat(self.db_path)
+        key = (st.st_dev, st.st_ino, self._generation)
+
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None and local.key != key:
+            self._discard(conn)
+            conn = None
+            with self._lock:
+                self.reopened += 1
+
+        if conn is None:
+            conn = self._open()
+            local.conn, local.key = conn, key
+            with self._lock:
+                self._conns.append(conn)
+                self.opened += 1
+
+        with self._lock:
+            self.checkouts += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn in self._conns:
+                self._conns.remove(conn)
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open_connections": len(self._conns),
+                "opened": self.opened,
+                "reopened": self.reopened,
+                "checkouts": self.checkouts,
+                "mmap_size": SQLITE_MMAP_SIZE,
+                "cache_kb": SQLITE_CACHE_KB,
+                "statement_cache": SQLITE_STATEMENT_CACHE,
+            }
+
+    def close(self):
+        with self._lock:
+            conns, self._conns = self._conns, []
+            self._generation += 1
+        for conn in conns:
+            conn.close()
@@ -3,6 +3,7 @@ import pandas as pd
 import sys
 
 from src.config import DB_PATH, FINAL_MASTER_DATASET_CSV_2
+from src.search.fts_index import create_fts, optimize_fts, rebuild_fts
 
 DB_FILE = DB_PATH
 CSV_FILE = FINAL_MASTER_DATASET_CSV_2
@@ -54,6 +55,10 @@ cur = conn.cursor()
 
 cur.execute("PRAGMA journal_mode=WAL;")
 
+# triggers keep the FTS index in sync with every upsert below; a DB created
+# before the index existed is indexed in full after the load
+fts_created = create_fts(conn)
+
 sql = """
 INSERT INTO books (
     row_id, isbn, title, author, year, publisher,
@@ -92,6 +97,10 @@ for r in df.itertuples(index=False):
     )
     rows += 1
 
+if fts_created:
+    rebuild_fts(conn)
+optimize_fts(conn)
+
 conn.commit()
 cur.close()
 conn.close()
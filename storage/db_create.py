@@ -1,6 +1,7 @@
 import sqlite3
 import sys
 from src.config import DB_PATH
+from src.search.fts_index import FTS_TABLE, migrate_search_schema
 
 DB_FILE = DB_PATH
 
@@ -22,8 +23,13 @@ CREATE TABLE IF NOT EXISTS books (
 )
 """)
 
+# full-text index for the lexical /search/* endpoints plus the ISBN index;
+# the FTS table is filled from any rows already present in an existing DB
+migrate_search_schema(conn)
+
 conn.commit()
 conn.close()
 
 print("Created DB:", DB_FILE)
 print("Created table: books")
+print("Created FTS index:", FTS_TABLE)